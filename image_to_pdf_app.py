@@ -1,14 +1,41 @@
 from tkinter import ttk
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk, ImageEnhance, ImageOps
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+from PIL import Image, ImageTk
+import image_to_pdf_core as core
+import image_to_pdf_document as documents
+import image_to_pdf_export as export
+import image_to_pdf_project as project
+import image_to_pdf_profile as profile
+from image_to_pdf_history import HistoryStore
+from image_to_pdf_pages import Page, PageCache, file_sources, pixels_key, stored_auto_adjust_task
+from image_to_pdf_store import default_store
+from image_to_pdf_display import DisplayCache
+from image_to_pdf_thumbs import ThumbnailCache
+from image_to_pdf_filmstrip import Filmstrip
+from image_to_pdf_zoom import PyramidCache, ZoomView, ZOOM_STEP
+from image_to_pdf_jobs import JobQueue, parse_page_range, FAILED, CANCELLED
+from functools import partial
 import threading
-import zipfile
-import json
-import io
+import os
+
+# PDF export presets: page image encoding and target resolution
+EXPORT_PRESETS = {
+    "Lossless": export.ExportOptions("flate"),
+    "High (JPEG, 300 dpi)": export.ExportOptions("auto", quality=90, dpi=300),
+    "Medium (JPEG, 200 dpi)": export.ExportOptions("auto", quality=80, dpi=200),
+    "Small (JPEG, 150 dpi)": export.ExportOptions("auto", quality=65, dpi=150),
+}
+
+# Scan mode Auto Adjust converts every page to
+SCAN_CHOICES = {
+    "Colour": None,
+    "Grayscale": "gray",
+    "Black & White": "bilevel",
+}
+
+# Canvas resizes are redrawn once they pause this long
+RESIZE_DELAY_MS = 150
 
 class ImageToPDFApp:
     def __init__(self, root):
@@ -16,29 +43,57 @@ class ImageToPDFApp:
         self.root.title("Image Editor & PDF Creator")
         self.root.geometry("1000x700")
 
-        self.images = []
-        self.history = []
-        self.redo_stack = []
+        self.pages = []  # lazy Page per image, pixels decoded on demand
+        self.history_store = HistoryStore()
+        self.page_cache = PageCache()
         self.lasso_points = []
         self.lasso_active = False
         self.slider_editing = False
-        self.pre_slider_image = None
         self.slider_updating = False
 
+        # Live slider preview works on a screen-sized proxy, the full
+        # resolution render runs in the background after release
+        self.slider_proxy = None
+        self.slider_preview_pending = False
+        self.slider_job = None
+
+        # Ready-made renders of the current page and its neighbours
+        self.display = DisplayCache()
+        self.thumbs = ThumbnailCache()
+        self.nav_direction = 1
+        self.resize_job = None
+
+        # Full resolution tile pyramids for zooming, built on first zoom
+        self.pyramids = PyramidCache()
+
+        # Auto adjust pool, ITP_WORKERS=0 means one worker per CPU
+        self.pool = None
+        self.pool_workers = int(os.environ.get("ITP_WORKERS", "0")) or None
+        self.pool_processes = os.environ.get("ITP_POOL", "process") != "thread"
+
+        # Exports and batch adjustments run in the background, one at a time
+        self.jobs = JobQueue(notify=lambda job: self.root.after(0, self._on_job_update, job))
+
         self.root.bind("<Control-z>", lambda e: self.undo())
         self.root.bind("<Control-y>", lambda e: self.redo())
         self.root.bind("<Delete>", lambda e: self.delete_current_image())
         self.root.bind("<Control-s>", lambda e: self.save_project())
+        self.root.bind("<Control-S>", lambda e: self.save_project(save_as=True))
         self.root.bind("<Control-o>", lambda e: self.open_project())
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
 
         self.current_index = 0
-        self.current_image = None
-        self.original_image = None
+
+        # Project file saves append to, None until saved or opened
+        self.project_path = None
+        self.saving = False
+        self.save_idle = threading.Event()  # cleared while a save writes the file
+        self.save_idle.set()
 
         self.tk_image = None
-        self.display_rect = None  # (x, y, w, h)
 
+        # Crop selection corners in image pixels, so it survives zoom and pan
         self.crop_start = None
         self.crop_end = None
 
@@ -61,10 +116,19 @@ class ImageToPDFApp:
         ttk.Button(sidebar, text="Crop Image", command=self.crop_image).pack(fill=tk.X, pady=4)
         ttk.Button(sidebar, text="Rotate Left", command=lambda: self.rotate(-90)).pack(fill=tk.X, pady=4)
         ttk.Button(sidebar, text="Rotate Right", command=lambda: self.rotate(90)).pack(fill=tk.X, pady=4)
+        ttk.Button(sidebar, text="Grayscale", command=lambda: self.scan("gray")).pack(fill=tk.X, pady=4)
+        ttk.Button(sidebar, text="Black & White", command=lambda: self.scan("bilevel")).pack(fill=tk.X, pady=4)
         ttk.Separator(sidebar).pack(fill=tk.X, pady=8)
         ttk.Button(sidebar, text="Replace Image", command=self.replace_current_image).pack(fill=tk.X, pady=4)
         ttk.Button(sidebar, text="Delete Image", command=self.delete_current_image).pack(fill=tk.X, pady=4)
 
+        ttk.Separator(sidebar).pack(fill=tk.X, pady=8)
+        ttk.Label(sidebar, text="Jobs").pack(anchor="w")
+        self.job_list = tk.Listbox(sidebar, height=8, width=30, activestyle="none")
+        self.job_list.pack(fill=tk.X, pady=4)
+        ttk.Button(sidebar, text="Cancel Job", command=self.cancel_job).pack(fill=tk.X, pady=2)
+        ttk.Button(sidebar, text="Clear Finished", command=self.clear_finished_jobs).pack(fill=tk.X, pady=2)
+
         ttk.Button(top, text="Save Project", command=self.save_project).pack(side=tk.LEFT, padx=4)
         ttk.Button(top, text="Open Project", command=self.open_project).pack(side=tk.LEFT, padx=4)
 
@@ -73,12 +137,49 @@ class ImageToPDFApp:
         ttk.Button(top, text="Undo", command=self.undo).pack(side=tk.LEFT, padx=4)
         ttk.Button(top, text="Redo", command=self.redo).pack(side=tk.LEFT, padx=4)
 
+        ttk.Button(top, text="Fit", command=self.zoom_fit).pack(side=tk.LEFT, padx=4)
+        ttk.Button(top, text="1:1", command=self.zoom_actual).pack(side=tk.LEFT, padx=4)
+
         ttk.Button(top, text="PDF", command=self.create_pdf).pack(side=tk.LEFT, padx=4)
 
+        self.export_preset = tk.StringVar(value=next(iter(EXPORT_PRESETS)))
+        ttk.Combobox(
+            top, textvariable=self.export_preset, values=list(EXPORT_PRESETS),
+            state="readonly", width=18
+        ).pack(side=tk.LEFT, padx=4)
+
+        # Pages to export, e.g. "1-5, 8"; empty exports all
+        ttk.Label(top, text="Pages").pack(side=tk.LEFT)
+        self.page_range = tk.StringVar()
+        ttk.Entry(top, textvariable=self.page_range, width=8).pack(side=tk.LEFT, padx=4)
+
         ttk.Button(top, text="◀ Prev", command=self.prev_image).pack(side=tk.LEFT, padx=4)
         ttk.Button(top, text="Next ▶", command=self.next_image).pack(side=tk.LEFT, padx=4)
         ttk.Button(top, text="Auto Adjust", command=self.auto_adjust_all).pack(side=tk.LEFT, padx=6)
 
+        # Auto Adjust also finds, crops and deskews photographed pages
+        self.document_mode = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            top, text="Documents", variable=self.document_mode,
+            state="normal" if documents.available() else "disabled"
+        ).pack(side=tk.LEFT, padx=4)
+
+        # Per-page levels from the histogram instead of fixed factors
+        self.adaptive_mode = tk.BooleanVar(value=False)
+        ttk.Checkbutton(top, text="Adaptive", variable=self.adaptive_mode).pack(side=tk.LEFT, padx=4)
+
+        self.scan_mode = tk.StringVar(value=next(iter(SCAN_CHOICES)))
+        ttk.Combobox(
+            top, textvariable=self.scan_mode, values=list(SCAN_CHOICES),
+            state="readonly", width=13
+        ).pack(side=tk.LEFT, padx=4)
+
+        # Stage timings, also on with ITP_PROFILE=1
+        self.profile_var = tk.BooleanVar(value=profile.enabled)
+        ttk.Checkbutton(
+            top, text="Profile", variable=self.profile_var, command=self.toggle_profile
+        ).pack(side=tk.LEFT, padx=4)
+
         controls = tk.Frame(self.root)
         controls.pack()
 
@@ -105,6 +206,19 @@ class ImageToPDFApp:
         self.canvas.bind("<Button-1>", self.start_crop)
         self.canvas.bind("<B1-Motion>", self.update_crop)
         self.canvas.bind("<ButtonRelease-1>", self.end_crop)
+        self.canvas.bind("<Configure>", self.on_canvas_resize)
+
+        # Wheel zooms at the pointer, middle or Shift+left drag pans
+        self.view = ZoomView(self.canvas, self.pyramids,
+                             on_ready=lambda: self.root.after(0, self._on_pyramid_ready))
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom_step(e.delta > 0, e.x, e.y))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom_step(True, e.x, e.y))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom_step(False, e.x, e.y))
+        for press, drag in (("<Button-2>", "<B2-Motion>"), ("<Shift-Button-1>", "<Shift-B1-Motion>")):
+            self.canvas.bind(press, self.start_pan)
+            self.canvas.bind(drag, self.update_pan)
+        self.canvas.bind("<Shift-ButtonRelease-1>", lambda e: None)  # not a crop
+        self.pan_from = (0, 0)
 
 
         tk.Label(controls, text="Contrast").pack(side=tk.LEFT)
@@ -139,42 +253,95 @@ class ImageToPDFApp:
         self.status = ttk.Label(self.root, text="Ready", anchor="w", padding=6)
         self.status.pack(side=tk.BOTTOM, fill=tk.X)
 
+        self.filmstrip = Filmstrip(self.root, self.thumbs, self.go_to)
+        self.filmstrip.pack(side=tk.BOTTOM, fill=tk.X)
+
+        self.profile_status = ttk.Label(self.root, anchor="w", padding=(6, 0), foreground="#555")
+        self.profile_job = None
+        if profile.enabled:
+            self.toggle_profile()
+
         for s in (self.brightness, self.contrast, self.saturation, self.sharpness):
             s.config(state="disabled")
 
+    # ---------------- Profiling ----------------
+    def toggle_profile(self):
+        on = self.profile_var.get()
+        profile.enable(on)
+
+        if on:
+            self.profile_status.pack(side=tk.BOTTOM, fill=tk.X, before=self.filmstrip.frame)
+            self._update_profile_status()
+        else:
+            self.profile_status.pack_forget()
+            if self.profile_job:
+                self.root.after_cancel(self.profile_job)
+                self.profile_job = None
+
+    def _update_profile_status(self):
+        self.profile_status.config(text=profile.summary() or "Profiling: no stages timed yet")
+        self.profile_job = self.root.after(1000, self._update_profile_status)
+
     # ----------- Open/Save Project --------------
 
-    def save_project(self):
-        if not self.images:
+    def save_project(self, save_as=False):
+        self.finish_slider_render()
+
+        if not self.pages:
             messagebox.showwarning("Save Project", "No project to save")
             return
 
-        path = filedialog.asksaveasfilename(
-            defaultextension=".itp",
-            filetypes=[("Image To PDF Project", "*.itp")]
-        )
-        if not path:
+        if self.saving:
+            self.status.config(text="Still saving the previous version…")
             return
 
-        try:
-            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
-                # Save images
-                for i, img in enumerate(self.images):
-                    buf = io.BytesIO()
-                    img.save(buf, format="PNG")
-                    z.writestr(f"images/{i}.png", buf.getvalue())
-
-                # Save metadata
-                project_data = {
-                    "image_count": len(self.images),
-                    "current_index": self.current_index
-                }
-                z.writestr("project.json", json.dumps(project_data))
-
-            messagebox.showinfo("Save Project", "Project saved successfully")
+        path = self.project_path
+        if save_as or not path:
+            path = filedialog.asksaveasfilename(
+                defaultextension=".itp",
+                filetypes=[("Image To PDF Project", "*.itp")]
+            )
+            if not path:
+                return
+
+        # Sources and op lists only, the worker does all file I/O
+        snap = project.snapshot(self.pages, self.current_index)
 
+        self.saving = True
+        self.save_idle.clear()
+        self.status.config(text="Saving project…")
+
+        thread = threading.Thread(
+            target=self._save_project_worker,
+            args=(path, snap, self.pages),
+            daemon=True
+        )
+        thread.start()
+
+    def _save_project_worker(self, path, snap, pages):
+        try:
+            project.save(path, snap)
+            done = partial(self._on_save_done, path, pages)
         except Exception as e:
-            messagebox.showerror("Save Failed", str(e))
+            done = partial(self._on_save_error, e)
+        finally:
+            self.save_idle.set()
+        try:
+            self.root.after(0, done)
+        except (RuntimeError, tk.TclError):
+            pass  # the window was closed once the file was written
+
+    def _on_save_done(self, path, pages):
+        self.saving = False
+        # Unless another image set was loaded meanwhile
+        if pages is self.pages:
+            self.project_path = path
+        self.status.config(text=f"Project saved to {os.path.basename(path)}")
+
+    def _on_save_error(self, error):
+        self.saving = False
+        self.status.config(text="Ready")
+        messagebox.showerror("Save Failed", str(error))
 
     def open_project(self):
         path = filedialog.askopenfilename(
@@ -184,24 +351,22 @@ class ImageToPDFApp:
             return
 
         try:
-            with zipfile.ZipFile(path, "r") as z:
-                project_data = json.loads(z.read("project.json"))
-
-                images = []
-                for i in range(project_data["image_count"]):
-                    img_data = z.read(f"images/{i}.png")
-                    img = Image.open(io.BytesIO(img_data)).convert("RGB")
-                    images.append(img)
+            # Only the manifest is read; pages decode from the zip on demand
+            current_index, entries = project.load(path)
 
             # Reset app before loading
             self.reset_app()
 
-            self.images = images
-            self.history = [[img.copy()] for img in self.images]
-            self.redo_stack = [[] for _ in self.images]
+            pages = []
+            for entry in entries:
+                page = self.new_page(entry.source)
+                page.restore(entry.ops, entry.page_size)
+                pages.append(page)
+            self.set_pages(pages)
 
-            self.current_index = project_data.get("current_index", 0)
-            self.slider.config(to=len(self.images) - 1)
+            self.project_path = path
+            self.current_index = current_index
+            self.slider.config(to=len(self.pages) - 1)
             self.slider.set(self.current_index)
             self.slider.config(state="normal")
 
@@ -215,78 +380,154 @@ class ImageToPDFApp:
     # ---------------- Image Load ----------------
     def load_images(self):
         files = filedialog.askopenfilenames(
-            filetypes=[("Images", "*.jpg *.png *.jpeg")]
+            filetypes=[("Images", "*.jpg *.png *.jpeg *.tif *.tiff *.gif *.pdf")]
         )
         if not files:
             return
 
-        self.images = [Image.open(f).convert("RGB") for f in files]
-        self.history = [[img.copy()] for img in self.images]
-        self.redo_stack = [[] for _ in self.images]
+        # Only headers are read here, pages decode when first needed.
+        # Multi-page TIFF, GIF and PDF files add a page per frame.
+        try:
+            sources = [source for f in files for source in file_sources(f)]
+        except Exception as e:
+            messagebox.showerror("Load Failed", str(e))
+            return
+        self.set_pages([self.new_page(source) for source in sources])
+        # A new image set, saving must not write into the last project
+        self.project_path = None
 
         self.current_index = 0
-        self.slider.config(to=len(self.images) - 1)
+        self.slider.config(to=len(self.pages) - 1)
         self.slider.set(0)
         self.slider.config(state="normal")
         self.load_current()
 
+    def new_page(self, source):
+        # source is a file path, an already decoded image or a page source
+        if isinstance(source, Image.Image):
+            return Page.from_image(source, self.history_store, self.page_cache)
+        if isinstance(source, str):
+            return Page.from_file(source, self.history_store, self.page_cache)
+        return Page(source, self.history_store, self.page_cache)
+
+    def set_pages(self, pages):
+        for page in self.pages:
+            page.discard()
+        self.pages = pages
+        self.filmstrip.set_pages(pages)
+
+    @property
+    def current_page(self):
+        return self.pages[self.current_index]
+
     def load_current(self):
-        if not self.images:
+        self.finish_slider_render()
+
+        if not self.pages:
             return
 
-        if self.current_index < 0 or self.current_index >= len(self.images):
+        if self.current_index < 0 or self.current_index >= len(self.pages):
             return
 
-        self.current_image = self.images[self.current_index]
-        self.original_image = self.current_image.copy()
         self.brightness.set(1.0)
+        self.clear_crop()
         self.show_image()
+        self.filmstrip.select(self.current_index)
+        self.display.prefetch(self.pages, self.current_index, self.nav_direction)
         for s in (self.brightness, self.contrast, self.saturation, self.sharpness):
             s.config(state="normal")
 
     # ---------------- Display ----------------
-    def show_image(self):
-        self.canvas.delete("all")
-
-        img = self.current_image.copy()
+    def canvas_size(self):
         cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
 
         if cw < 50 or ch < 50:
             self.root.update_idletasks()
             cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
 
-        img.thumbnail((cw - 40, ch - 40))
+        return cw, ch
+
+    def show_image(self, preview=None):
+        self.canvas.delete("all")
+
+        cw, ch = self.canvas_size()
+
+        # preview is already screen sized (slider proxy), shown fitted
+        if preview is None:
+            self.display.set_box((cw - 40, ch - 40))
+            img, self.tk_image = self.display.get(self.current_page)
+            self.filmstrip.refresh()
+        else:
+            img = preview
+            self.tk_image = ImageTk.PhotoImage(img)
+
+        self.view.draw(self.current_page, img, self.tk_image, fit=preview is not None)
+        self.draw_crop()
+
+    def on_canvas_resize(self, event):
+        # Renders are per canvas size, redraw once resizing has paused
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_DELAY_MS, self._redraw) if self.pages else None
+
+    def _redraw(self):
+        self.resize_job = None
+        if self.pages and not self.slider_editing:
+            self.show_image()
+            self.display.prefetch(self.pages, self.current_index, self.nav_direction)
+
+    # ---------------- Zoom ----------------
+    def zoom_step(self, zoom_in, x, y):
+        if self.pages and not self.slider_editing:
+            if self.view.zoom_at(ZOOM_STEP if zoom_in else 1 / ZOOM_STEP, x, y):
+                self.show_image()
 
-        w, h = img.size
-        x = (cw - w) // 2
-        y = (ch - h) // 2
+    def zoom_fit(self):
+        if self.pages and self.view.fit():
+            self.show_image()
+
+    def zoom_actual(self):
+        if self.pages and not self.slider_editing:
+            cw, ch = self.canvas_size()
+            if self.view.actual_size(cw / 2, ch / 2):
+                self.show_image()
 
-        self.display_rect = (x, y, w, h)
+    def start_pan(self, e):
+        self.pan_from = (e.x, e.y)
 
-        self.tk_image = ImageTk.PhotoImage(img)
-        self.canvas.create_image(x, y, image=self.tk_image, anchor="nw")
+    def update_pan(self, e):
+        dx, dy = e.x - self.pan_from[0], e.y - self.pan_from[1]
+        self.pan_from = (e.x, e.y)
+        if self.pages and not self.slider_editing and self.view.pan(dx, dy):
+            self.show_image()
+
+    def _on_pyramid_ready(self):
+        if self.pages and not self.slider_editing and self.view.zoomed:
+            self.show_image()
 
     # ---------------- Navigation ----------------
     def prev_image(self):
-        if not self.images:
+        if not self.pages:
             return
 
         if self.current_index > 0:
+            self.nav_direction = -1
             self.current_index -= 1
             self.slider.set(self.current_index)
             self.load_current()
 
     def next_image(self):
-        if not self.images:
+        if not self.pages:
             return
 
-        if self.current_index < len(self.images) - 1:
+        if self.current_index < len(self.pages) - 1:
+            self.nav_direction = 1
             self.current_index += 1
             self.slider.set(self.current_index)
             self.load_current()
 
     def change_image(self, value):
-        if self.slider_updating or not self.images:
+        if self.slider_updating or not self.pages:
             return
         
         index = round(float(value))
@@ -294,16 +535,24 @@ class ImageToPDFApp:
         if index == self.current_index:
             return  # ignore noise
 
-        if 0 <= index < len(self.images):
-            self.current_index = index
-            self.load_current()
+        self.go_to(index)
+
+    def go_to(self, index):
+        if not 0 <= index < len(self.pages) or index == self.current_index:
+            return
+
+        self.nav_direction = 1 if index > self.current_index else -1
+        self.current_index = index
+        self.load_current()
 
         self.slider_updating = True
         self.slider.set(self.current_index)
         self.slider_updating = False
 
     def delete_current_image(self):
-        if not self.images:
+        self.finish_slider_render()
+
+        if not self.pages:
             return
 
         confirm = messagebox.askyesno(
@@ -315,50 +564,46 @@ class ImageToPDFApp:
 
         idx = self.current_index
 
-        # Remove image & history
-        del self.images[idx]
-        del self.history[idx]
-        del self.redo_stack[idx]
+        # Remove page & history
+        self.pages.pop(idx).discard()
+        self.filmstrip.set_pages(self.pages)
 
-        if not self.images:
+        if not self.pages:
             # No images left
             self.reset_app()
             return
 
         # Adjust index safely
-        if idx >= len(self.images):
-            idx = len(self.images) - 1
+        if idx >= len(self.pages):
+            idx = len(self.pages) - 1
 
         self.current_index = idx
-        self.slider.config(to=len(self.images) - 1)
+        self.slider.config(to=len(self.pages) - 1)
         self.slider.set(self.current_index)
 
         self.load_current()
 
     def replace_current_image(self):
-        if not self.images:
+        self.finish_slider_render()
+
+        if not self.pages:
             return
 
         file = filedialog.askopenfilename(
-            filetypes=[("Images", "*.jpg *.png *.jpeg")]
+            filetypes=[("Images", "*.jpg *.png *.jpeg *.tif *.tiff *.gif *.pdf")]
         )
         if not file:
             return
 
         try:
-            new_img = Image.open(file).convert("RGB")
+            # The first page of a multi-page file
+            new_page = self.new_page(file_sources(file)[0])
 
             idx = self.current_index
 
-            # Replace image
-            self.images[idx] = new_img
-
-            # Reset history for this image
-            self.history[idx] = [new_img.copy()]
-            self.redo_stack[idx] = []
-
-            self.current_image = new_img
-            self.original_image = new_img.copy()
+            # Replace page, its history starts over
+            self.pages[idx].discard()
+            self.pages[idx] = new_page
 
             self.show_image()
 
@@ -369,205 +614,296 @@ class ImageToPDFApp:
 
 
     # ---------------- History ----------------
-    def push_history(self):
-        if not self.images:
+    def undo(self):
+        self.finish_slider_render()
+
+        if not self.pages:
             return
-        self.history[self.current_index].append(self.current_image.copy())
-        self.redo_stack[self.current_index].clear()
 
-    def undo(self):
-        h = self.history[self.current_index]
-        if len(h) > 1:
-            self.redo_stack[self.current_index].append(h.pop())
-            self.current_image = h[-1].copy()
-            self.images[self.current_index] = self.current_image
+        if self.current_page.undo():
             self.show_image()
 
     def redo(self):
-        r = self.redo_stack[self.current_index]
-        if r:
-            img = r.pop()
-            self.history[self.current_index].append(img)
-            self.current_image = img.copy()
-            self.images[self.current_index] = self.current_image
+        self.finish_slider_render()
+
+        if not self.pages:
+            return
+
+        if self.current_page.redo():
             self.show_image()
 
     # ---------------- Edit Ops ----------------
 
     def rotate(self, angle):
-        self.push_history()
-        self.current_image = self.current_image.rotate(angle, expand=True)
-        self.original_image = self.current_image.copy()
-        self.images[self.current_index] = self.current_image
-        self.show_image()
+        self.finish_slider_render()
 
-    def auto_adjust_all(self):
-        if not self.images:
-            messagebox.showwarning("Auto Adjust", "No images loaded")
+        if not self.pages:
             return
 
-        # Show loader
-        self.show_loader("Auto adjusting images...\nPlease wait")
-
-        thread = threading.Thread(
-            target=self._auto_adjust_worker,
-            daemon=True
-        )
-        thread.start()
-
-    def _auto_adjust_worker(self):
-        try:
-            new_images = []
-
-            for img in self.images:
-                img = self._auto_rotate(img)
-                img = self._auto_enhance(img)
-                new_images.append(img)
-
-            # Back to UI thread
-            self.root.after(0, lambda: self._on_auto_adjust_done(new_images))
-
-        except Exception as e:
-            self.root.after(0, lambda: self._on_auto_adjust_error(e))
-
-    def _auto_rotate(self, img):
-        try:
-            # This fixes camera-rotated images properly
-            img = ImageOps.exif_transpose(img)
-        except Exception:
-            pass
-        return img
+        # Recorded as page geometry, the full-size pixels are not touched
+        self.current_page.edit({"op": "rotate", "angle": angle})
+        self.show_image()
 
-    def _auto_enhance(self, img):
-        # Gentle brightness boost
-        img = ImageEnhance.Brightness(img).enhance(1.05)
+    def scan(self, mode):
+        # Current page only; the whole document goes through Auto Adjust
+        self.finish_slider_render()
 
-        # Gentle contrast boost (text clarity)
-        img = ImageEnhance.Contrast(img).enhance(1.25)
+        if not self.pages:
+            return
 
-        # Slight saturation boost (ink visibility)
-        img = ImageEnhance.Color(img).enhance(1.1)
+        page = self.current_page
+        page.edit({"op": "scan", "mode": mode}, core.convert_scan(page.image, mode))
+        self.show_image()
 
-        # Optional: slight sharpening
-        img = ImageEnhance.Sharpness(img).enhance(1.1)
+    def auto_adjust_all(self):
+        self.finish_slider_render()
 
-        return img
+        if not self.pages:
+            messagebox.showwarning("Auto Adjust", "No images loaded")
+            return
 
-    def _on_auto_adjust_done(self, new_images):
-        self.hide_loader()
+        if self.pool is None:
+            self.pool = core.make_pool(self.pool_workers, processes=self.pool_processes)
 
-        self.images = new_images
-        self.history = [[img.copy()] for img in self.images]
-        self.redo_stack = [[] for _ in self.images]
+        # Pages as they are now; editing carries on while the job runs
+        snaps = [page.snapshot() for page in self.pages]
+        options = self.auto_options()
+        self.jobs.submit(
+            f"Auto adjust {len(snaps)} pages",
+            partial(self._auto_adjust_job, snaps, options),
+            on_done=self._on_auto_adjust_done
+        )
 
-        self.current_index = 0
-        self.slider.config(to=len(self.images) - 1)
-        self.slider.set(0)
-        self.slider.config(state="normal")
+    def auto_options(self):
+        # Only the options that are on, so plain runs record {"op": "auto"}
+        options = {
+            "document": self.document_mode.get(),
+            "adaptive": self.adaptive_mode.get(),
+            "scan": SCAN_CHOICES[self.scan_mode.get()],
+        }
+        return {k: value for k, value in options.items() if value}
+
+    def _auto_adjust_job(self, snaps, options, job):
+        # Each page is applied as soon as its result is in, so only the
+        # pool's window of pages is ever rendered or held at once. Workers
+        # also put results in the disk store; pages adjusted the same way
+        # before, in this run or an earlier one, are not adjusted again.
+        store = default_store()
+        op = {"op": "auto", **options}
+        counts = {"applied": 0, "skipped": 0}
+        apply = lambda snap, img=None, size=None: self.root.after(
+            0, self._apply_auto_adjust, snap, op, img, size, counts
+        )
 
-        self.load_current()
+        todo = []
+        for snap in snaps:
+            key = pixels_key(snap.source, snap.ops + [op]) if store.enabled else None
+            size = store.image_size(key)
+            if size is None:
+                todo.append((snap, key))
+            else:
+                apply(snap, size=size)
+        done = len(snaps) - len(todo)
+        job.progress(done, len(snaps))
+
+        # Thread pool workers render edited pages themselves; for worker
+        # processes each is rendered here just before it is sent
+        items = ((snap.task() if self.pool_processes else snap, key) for snap, key in todo)
+        task = partial(stored_auto_adjust_task, **options)
+        with profile.stage("auto_adjust_batch"):
+            for (snap, _), img in zip(todo, core.pool_map(self.pool, task, items)):
+                # The page keeps the pixels in its cache, and as a keyframe
+                # when one is due, not only in the store, which may evict it
+                apply(snap, img)
+                done += 1
+                job.progress(done, len(snaps))
+                if job.cancelled:
+                    break
+        return counts
+
+    def _apply_auto_adjust(self, snap, op, img, size, counts):
+        # Recorded as an undoable op on the page. Pages edited or deleted
+        # (discarded) since the job started keep their newer state.
+        if not snap.current:
+            counts["skipped"] += 1
+            return
+        snap.page.edit(op, img, size=size)
+        counts["applied"] += 1
+        if self.pages and snap.page is self.current_page:
+            self.show_image()
 
-        messagebox.showinfo("Auto Adjust", "All images auto adjusted successfully")
+    def _on_auto_adjust_done(self, counts):
+        if self.pages:
+            self.show_image()
 
-    def _on_auto_adjust_error(self, error):
-        self.hide_loader()
-        messagebox.showerror("Auto Adjust Failed", str(error))
+        skipped = counts["skipped"]
+        self.status.config(
+            text=f"Auto adjusted {counts['applied']} pages"
+            + (f", {skipped} changed meanwhile and left as they were" if skipped else "")
+        )
 
     # ---------------- Crop (FIXED) ----------------
     def start_crop(self, e):
-        self.crop_start = (e.x, e.y)
+        self.crop_start = self.view.to_image(e.x, e.y)
+        self.crop_end = None
 
     def update_crop(self, e):
-        self.canvas.delete("crop")
-        self.canvas.create_rectangle(
-            self.crop_start[0], self.crop_start[1],
-            e.x, e.y, outline="red", tag="crop"
-        )
+        if self.crop_start:
+            self.crop_end = self.view.to_image(e.x, e.y)
+            self.draw_crop()
 
     def end_crop(self, e):
-        self.crop_end = (e.x, e.y)
+        if self.crop_start:
+            self.crop_end = self.view.to_image(e.x, e.y)
+            self.draw_crop()
+
+    def clear_crop(self):
+        self.crop_start = None
+        self.crop_end = None
+        self.canvas.delete("crop")
+
+    def draw_crop(self):
+        self.canvas.delete("crop")
+        if self.crop_start and self.crop_end:
+            x1, y1 = self.view.to_canvas(*self.crop_start)
+            x2, y2 = self.view.to_canvas(*self.crop_end)
+            self.canvas.create_rectangle(x1, y1, x2, y2, outline="red", tag="crop")
 
     def crop_image(self):
+        self.finish_slider_render()
+
         if not self.crop_start or not self.crop_end:
             messagebox.showwarning("Crop", "Drag to select crop area")
             return
 
-        self.push_history()
+        if not self.pages:
+            return
 
-        dx, dy, dw, dh = self.display_rect
-        img_w, img_h = self.current_image.size
+        page = self.current_page
+        img_w, img_h = page.size
 
-        # Normalize crop rectangle
+        # Normalize crop rectangle, already in image coordinates
         x1 = min(self.crop_start[0], self.crop_end[0])
         y1 = min(self.crop_start[1], self.crop_end[1])
         x2 = max(self.crop_start[0], self.crop_end[0])
         y2 = max(self.crop_start[1], self.crop_end[1])
 
-        # Clamp to image display area
-        x1 = max(x1, dx)
-        y1 = max(y1, dy)
-        x2 = min(x2, dx + dw)
-        y2 = min(y2, dy + dh)
-
-        # Convert to image coordinates
-        scale_x = img_w / dw
-        scale_y = img_h / dh
-
-        ix1 = int((x1 - dx) * scale_x)
-        iy1 = int((y1 - dy) * scale_y)
-        ix2 = int((x2 - dx) * scale_x)
-        iy2 = int((y2 - dy) * scale_y)
+        # Clamp to the image
+        ix1 = max(int(x1), 0)
+        iy1 = max(int(y1), 0)
+        ix2 = min(int(x2), img_w)
+        iy2 = min(int(y2), img_h)
 
         if ix2 <= ix1 or iy2 <= iy1:
             messagebox.showwarning("Crop", "Invalid crop area")
             return
 
-        self.current_image = self.current_image.crop((ix1, iy1, ix2, iy2))
-        self.original_image = self.current_image.copy()
-        self.images[self.current_index] = self.current_image
+        box = (ix1, iy1, ix2, iy2)
+        page.edit({"op": "crop", "box": list(box)})
 
-        self.crop_start = None
-        self.crop_end = None
+        self.clear_crop()
 
         self.show_image()
 
     
     # ------------------ slider ---------------------
+    def slider_values(self):
+        return {
+            "brightness": self.brightness.get(),
+            "contrast": self.contrast.get(),
+            "saturation": self.saturation.get(),
+            "sharpness": self.sharpness.get()
+        }
+
     def on_slider_start(self, event):
-        if not self.slider_editing:
+        if not self.slider_editing and self.pages:
+            # Start from the committed image
+            self.finish_slider_render()
+
             self.slider_editing = True
-            self.pre_slider_image = self.current_image.copy()
-    
+
+            cw, ch = self.canvas_size()
+            self.slider_proxy = self.current_page.preview((cw - 40, ch - 40))
+
     def on_slider_change(self, _=None):
         if not self.slider_editing:
             return
 
-        img = self.pre_slider_image.copy()
+        # Coalesce rapid events, the render reads the newest values
+        if not self.slider_preview_pending:
+            self.slider_preview_pending = True
+            self.root.after_idle(self._render_slider_preview)
 
-        img = ImageEnhance.Brightness(img).enhance(self.brightness.get())
-        img = ImageEnhance.Contrast(img).enhance(self.contrast.get())
-        img = ImageEnhance.Color(img).enhance(self.saturation.get())
-        img = ImageEnhance.Sharpness(img).enhance(self.sharpness.get())
+    def _render_slider_preview(self):
+        self.slider_preview_pending = False
+        if not self.slider_editing:
+            return
 
-        self.current_image = img
-        self.images[self.current_index] = img
-        self.show_image()
+        self.show_image(core.enhance(self.slider_proxy, **self.slider_values()))
 
     def on_slider_release(self, event):
-        if self.slider_editing:
-            self.slider_editing = False
-            self.push_history()
-            self.original_image = self.current_image.copy()
+        if not self.slider_editing:
+            return
+
+        self.slider_editing = False
+        self.slider_proxy = None
+
+        page = self.current_page
+        job = {
+            "page": page,
+            "version": page.version,
+            "params": self.slider_values(),
+            "result": None
+        }
+
+        def work():
+            job["result"] = core.enhance(page.image, **job["params"])
+            self.root.after(0, lambda: self._apply_slider_job(job))
+
+        job["thread"] = threading.Thread(target=work, daemon=True)
+        self.slider_job = job
+        job["thread"].start()
+
+    def finish_slider_render(self):
+        # Wait for a pending full resolution render so edits, navigation
+        # and export always see the committed image
+        job = self.slider_job
+        if job is not None:
+            job["thread"].join()
+            self._apply_slider_job(job)
+
+    def _apply_slider_job(self, job):
+        if job is not self.slider_job:
+            return  # already applied
+        self.slider_job = None
+
+        if job["result"] is None:
+            return  # render failed
+
+        page = job["page"]
+        if page.version != job["version"] or page not in self.pages:
+            return
+
+        page.edit({"op": "enhance", **job["params"]}, job["result"])
+        if page is self.current_page:
+            self.show_image()
     # ---------------- PDF ----------------
 
     def create_pdf(self):
-        if not self.images:
+        if not self.pages:
             messagebox.showwarning("PDF", "No images to export")
             return
 
         # Commit last slider edit
         if self.slider_editing:
             self.on_slider_release(None)
+        self.finish_slider_render()
+
+        try:
+            indices = parse_page_range(self.page_range.get(), len(self.pages))
+        except ValueError as e:
+            messagebox.showwarning("PDF", str(e))
+            return
 
         path = filedialog.asksaveasfilename(
             defaultextension=".pdf",
@@ -576,29 +912,27 @@ class ImageToPDFApp:
         if not path:
             return
 
-        # Show loader
-        self.status.config(text="Generating PDF…")
-        self.show_loader("Generating PDF...\nPlease wait")
-
-        # Run PDF generation in background
-        thread = threading.Thread(
-            target=self._generate_pdf_worker,
-            args=(path,),
-            daemon=True
+        # Queued with the pages as they are now, the session is kept
+        preset = self.export_preset.get()
+        snaps = [self.pages[i].snapshot() for i in indices]
+        self.jobs.submit(
+            f"PDF {os.path.basename(path)} ({preset})",
+            partial(self._export_job, path, snaps, EXPORT_PRESETS[preset]),
+            on_done=lambda count: self.status.config(
+                text=f"PDF saved to {os.path.basename(path)}, {count} pages"
+            )
         )
-        thread.start()
 
     def reset_app(self):
-        self.images.clear()
-        self.history.clear()
-        self.redo_stack.clear()
+        self.set_pages([])
+        self.display.clear()
+        self.project_path = None
 
         self.current_index = 0
-        self.current_image = None
-        self.original_image = None
 
         self.slider_editing = False
-        self.pre_slider_image = None
+        self.slider_proxy = None
+        self.slider_job = None
 
         self.crop_start = None
         self.crop_end = None
@@ -615,73 +949,74 @@ class ImageToPDFApp:
 
         # Clear canvas
         self.canvas.delete("all")
+        self.view.reset()
+        self.pyramids.clear()
 
         for s in (self.brightness, self.contrast, self.saturation, self.sharpness):
             s.config(state="disabled")
 
-# -------------- Loader ----------------
-
-    def show_loader(self, text="Processing..."):
-        self.loader = tk.Toplevel(self.root)
-        self.loader.title("Please wait")
-        self.loader.geometry("300x100")
-        self.loader.resizable(False, False)
-        self.loader.transient(self.root)
-        self.loader.grab_set()
-
-        tk.Label(
-            self.loader,
-            text=text,
-            font=("Arial", 11)
-        ).pack(expand=True, pady=20)
-
-        self.loader.update()
-
-    def hide_loader(self):
-        if hasattr(self, "loader") and self.loader:
-            self.loader.destroy()
-            self.loader = None
-    
-    def _generate_pdf_worker(self, path):
-        try:
-            pdf = canvas.Canvas(path, pagesize=A4)
-            pw, ph = A4
-
-            # Snapshot to avoid mutation
-            export_images = [img.copy() for img in self.images]
+    def _export_job(self, path, snaps, options, job):
+        # Snapshots are decoded and encoded on a thread pool, a few at a
+        # time, and written in order; repeated pages are encoded once
+        with core.make_pool(self.pool_workers, processes=False) as pool:
+            return export.write_pdf(
+                snaps, path, options, pool=pool, task=export.encode_page_task,
+                progress=job.progress, cancel=job.cancel_event, key=export.page_key
+            )
 
-            for img in export_images:
-                reader = ImageReader(img)
-                iw, ih = img.size
+# -------------- Jobs ----------------
 
-                scale = min(pw / iw, ph / ih)
-                nw, nh = iw * scale, ih * scale
+    def _on_job_update(self, job):
+        self.refresh_jobs()
 
-                pdf.drawImage(
-                    reader,
-                    (pw - nw) / 2,
-                    (ph - nh) / 2,
-                    nw, nh
-                )
-                pdf.showPage()
-
-            pdf.save()
-
-            # Back to UI thread
-            self.root.after(0, self._on_pdf_success)
-
-        except Exception as e:
-            self.root.after(0, lambda: self._on_pdf_error(e))
-
-    def _on_pdf_success(self):
-        self.hide_loader()
-        self.status.config(text="Ready")
-        messagebox.showinfo("Success", "PDF created successfully")
-        self.reset_app()
-
-    def _on_pdf_error(self, error):
-        self.hide_loader()
-        messagebox.showerror("Error", f"Failed to create PDF:\n{error}")
+        if not job.finished or job.reported:
+            return
+        job.reported = True
+
+        if job.state == FAILED:
+            self.status.config(text=f"{job.title} failed")
+            messagebox.showerror("Job Failed", f"{job.title}:\n{job.error}")
+        elif job.state == CANCELLED:
+            self.status.config(text=f"{job.title} cancelled")
+        elif job.on_done:
+            job.on_done(job.result)
+
+    def refresh_jobs(self):
+        selected = self.job_list.curselection()
+        self.job_list.delete(0, tk.END)
+        for job in self.jobs.jobs:
+            self.job_list.insert(tk.END, job.describe())
+        for i in selected:
+            if i < self.job_list.size():
+                self.job_list.selection_set(i)
+
+    def cancel_job(self):
+        for i in self.job_list.curselection():
+            if i < len(self.jobs.jobs):
+                self.jobs.jobs[i].cancel()
+        self.refresh_jobs()
+
+    def clear_finished_jobs(self):
+        self.jobs.clear_finished()
+        self.refresh_jobs()
+
+    def on_close(self):
+        # A project save in progress is finished first, stopping it halfway
+        # through an append would leave the file unreadable
+        if not self.save_idle.is_set():
+            self.status.config(text="Finishing project save…")
+            self.root.update_idletasks()
+            self.save_idle.wait()
+
+        # Running jobs stop at their next page, unfinished PDFs are removed
+        self.jobs.close()
+        self.thumbs.close()
+        self.display.close()
+        self.pyramids.close()
+        if self.pool is not None:
+            # Workers would otherwise outlive the window
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
 
 # ---------------- RUN ----------------
 if __name__ == "__main__":
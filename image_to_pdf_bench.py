@@ -0,0 +1,341 @@
+from PIL import Image, ImageDraw
+from functools import partial
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+import image_to_pdf_core as core
+import image_to_pdf_export as export
+import image_to_pdf_project as project
+import image_to_pdf_thumbs as thumbs
+from image_to_pdf_history import HistoryStore
+from image_to_pdf_pages import Page, PageCache
+
+# Benchmarks for the image and PDF hot paths:
+#
+#   python image_to_pdf_bench.py --pages 24 --output before.json
+#   python image_to_pdf_bench.py --pages 24 --output after.json
+#   python image_to_pdf_bench.py --compare before.json after.json
+#
+# A synthetic image set (mixed sizes, JPEG and PNG, EXIF orientations) is
+# generated from a fixed seed, so runs on the same machine are comparable.
+# Every stage runs in a fresh process, and the peak RSS reported is that
+# process's own high-water mark; the best of --repeat runs is reported. --compare exits with 1 when a stage lost
+# more than --threshold percent of its throughput.
+
+SIZES = [(1240, 1754), (2480, 3508), (4032, 3024), (1600, 1200)]
+ORIENTATIONS = [1, 1, 3, 6, 8]
+SCREEN_BOX = (960, 660)  # what the app previews into on a 1000x700 window
+
+
+# ---------------- Image set ----------------
+def make_image(size, rng):
+    # Paper-like page: a soft gradient, a photo block and lines of "text"
+    w, h = size
+    img = Image.linear_gradient("L").resize(size).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", size, (235, 230, 220)), 0.8)
+    draw = ImageDraw.Draw(img)
+
+    draw.rectangle(
+        (w // 10, h // 12, w // 2, h // 3),
+        fill=tuple(rng.randrange(40, 200) for _ in range(3))
+    )
+    line = max(h // 60, 4)
+    for y in range(h // 3 + line, h - h // 12, line * 2):
+        x = w // 10
+        while x < w - w // 10:
+            word = rng.randrange(line * 2, line * 8)
+            draw.rectangle((x, y, min(x + word, w - w // 10), y + line), fill=(30, 30, 30))
+            x += word + line
+    return img
+
+
+def generate_images(directory, count, seed=0):
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        img = make_image(SIZES[i % len(SIZES)], rng)
+        if i % 3 == 2:
+            path = os.path.join(directory, f"page{i:04d}.png")
+            img.save(path, format="PNG")
+        else:
+            path = os.path.join(directory, f"page{i:04d}.jpg")
+            exif = Image.Exif()
+            exif[0x0112] = ORIENTATIONS[i % len(ORIENTATIONS)]
+            img.save(path, format="JPEG", quality=90, exif=exif)
+        files.append(path)
+    return files
+
+
+# ---------------- Stages ----------------
+# Each stage takes the input files and a scratch directory and returns the
+# number of pages it processed.
+def new_pages(files):
+    store, cache = HistoryStore(), PageCache()
+    return [Page.from_file(f, store, cache) for f in files]
+
+
+def stage_decode(files, scratch):
+    for f in files:
+        core.load_image(f)
+    return len(files)
+
+
+def stage_auto_adjust(files, scratch):
+    # Decode excluded, it is measured on its own
+    images = [core.load_image(f) for f in files]
+    start = time.perf_counter()
+    for img in images:
+        core.auto_adjust(img)
+    return len(images), time.perf_counter() - start
+
+
+def stage_show_image(files, scratch):
+    # Cold display render, as on first navigation to a page
+    for page in new_pages(files):
+        page.preview(SCREEN_BOX)
+    return len(files)
+
+
+def stage_slider_preview(files, scratch):
+    # One live slider update on the screen-sized proxy per page
+    for page in new_pages(files):
+        proxy = page.preview(SCREEN_BOX)
+        core.enhance(proxy, brightness=1.1, contrast=1.2, saturation=0.9, sharpness=1.5)
+    return len(files)
+
+
+def stage_slider_commit(files, scratch):
+    images = [core.load_image(f) for f in files]
+    start = time.perf_counter()
+    for img in images:
+        core.enhance(img, brightness=1.1, contrast=1.2, saturation=0.9, sharpness=1.5)
+    return len(images), time.perf_counter() - start
+
+
+def stage_thumbnails(files, scratch):
+    store = thumbs.ThumbStore(os.path.join(scratch, "thumbs"))
+    for page in new_pages(files):
+        thumbs.thumb_bytes(page, store=store)
+    return len(files)
+
+
+def stage_project_save(files, scratch):
+    pages = new_pages(files)
+    for page in pages[::2]:
+        page.restore([{"op": "rotate", "angle": 90}])
+    project.save(os.path.join(scratch, "bench.itp"), project.snapshot(pages, 0))
+    return len(pages)
+
+
+def stage_project_open(files, scratch):
+    # Saved outside the timed part, then opened and the first page shown
+    path = os.path.join(scratch, "open.itp")
+    project.save(path, project.snapshot(new_pages(files), 0))
+    project.close_zip(path)
+
+    start = time.perf_counter()
+    store, cache = HistoryStore(), PageCache()
+    _, entries = project.load(path)
+    pages = []
+    for entry in entries:
+        page = Page(entry.source, store, cache)
+        page.restore(entry.ops, entry.page_size)
+        pages.append(page)
+    pages[0].preview(SCREEN_BOX)
+    return len(pages), time.perf_counter() - start
+
+
+def stage_export(files, scratch):
+    options = export.ExportOptions("auto", quality=80, dpi=200)
+    return export.write_pdf(files, os.path.join(scratch, "serial.pdf"), options,
+                            task=export.encode_file)
+
+
+def stage_export_parallel(files, scratch):
+    options = export.ExportOptions("auto", quality=80, dpi=200)
+    with core.make_pool(processes=False) as pool:
+        return export.write_pdf(files, os.path.join(scratch, "parallel.pdf"), options,
+                                pool=pool, task=export.encode_file)
+
+
+def stage_export_repeat(files, scratch):
+    # Auto adjusted export run twice, the second from the disk store
+    options = export.ExportOptions("auto", quality=80, dpi=200)
+    task = partial(export.encode_file, auto_adjust=True)
+    export.write_pdf(files, os.path.join(scratch, "first.pdf"), options, task=task)
+    start = time.perf_counter()
+    count = export.write_pdf(files, os.path.join(scratch, "repeat.pdf"), options, task=task)
+    return count, time.perf_counter() - start
+
+
+STAGES = {
+    "decode": stage_decode,
+    "auto_adjust": stage_auto_adjust,
+    "show_image": stage_show_image,
+    "slider_preview": stage_slider_preview,
+    "slider_commit": stage_slider_commit,
+    "thumbnails": stage_thumbnails,
+    "project_save": stage_project_save,
+    "project_open": stage_project_open,
+    "export": stage_export,
+    "export_parallel": stage_export_parallel,
+    "export_repeat": stage_export_repeat,
+}
+
+
+# ---------------- Runner ----------------
+def peak_rss_mb():
+    # VmHWM where there is /proc: on Linux ru_maxrss carries over fork and
+    # exec, so a stage process would report at least the parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None  # not available on Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(name, files, scratch):
+    # Runs in a fresh process. Stages that need setup return their own
+    # timing as (pages, seconds).
+    os.makedirs(scratch, exist_ok=True)
+    # Keep the user's thumbnail and page stores out of it, every run starts cold
+    os.environ["ITP_THUMB_DIR"] = os.path.join(scratch, "thumb-cache")
+    os.environ["ITP_STORE_DIR"] = os.path.join(scratch, "page-store")
+    start = time.perf_counter()
+    result = STAGES[name](files, scratch)
+    elapsed = time.perf_counter() - start
+    if isinstance(result, tuple):
+        result, elapsed = result
+    return {"pages": result, "seconds": elapsed, "peak_rss_mb": peak_rss_mb()}
+
+
+def measure(name, files, scratch, repeat):
+    ctx = multiprocessing.get_context("spawn")
+    runs = []
+    for i in range(repeat):
+        with ctx.Pool(1) as pool:
+            runs.append(pool.apply(run_stage, (name, files, os.path.join(scratch, f"{name}-{i}"))))
+
+    best = min(runs, key=lambda r: r["seconds"])
+    return {
+        "pages": best["pages"],
+        "seconds": round(best["seconds"], 4),
+        "pages_per_sec": round(best["pages"] / best["seconds"], 3) if best["seconds"] else None,
+        "peak_rss_mb": round(max(r["peak_rss_mb"] or 0 for r in runs), 1) or None,
+        "runs": [round(r["seconds"], 4) for r in runs],
+    }
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(stages, pages, repeat, seed, keep=None):
+    scratch = keep or tempfile.mkdtemp(prefix="itp-bench-")
+    try:
+        images = os.path.join(scratch, "images")
+        os.makedirs(images, exist_ok=True)
+        files = generate_images(images, pages, seed)
+
+        results = {}
+        for name in stages:
+            results[name] = measure(name, files, scratch, repeat)
+            r = results[name]
+            print(f"{name:16} {r['pages_per_sec']:>9} pages/s  {r['seconds']:>8.3f}s  "
+                  f"{r['peak_rss_mb'] or '-':>7} MB")
+    finally:
+        if keep is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pages": pages,
+        "repeat": repeat,
+        "seed": seed,
+        "stages": results,
+    }
+
+
+def compare(base, new, threshold):
+    # Returns the stages whose throughput dropped by more than threshold %
+    regressions = []
+    for name, after in new["stages"].items():
+        before = base["stages"].get(name)
+        if not before or not before["pages_per_sec"] or not after["pages_per_sec"]:
+            continue
+        change = (after["pages_per_sec"] / before["pages_per_sec"] - 1) * 100
+        flag = "REGRESSION" if change < -threshold else ""
+        print(f"{name:16} {before['pages_per_sec']:>9} -> {after['pages_per_sec']:>9} pages/s  "
+              f"{change:+6.1f}%  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image and PDF pipeline")
+    parser.add_argument("--pages", type=int, default=24, help="synthetic pages to generate")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, best is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--output", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--keep", metavar="DIR", help="keep the images and outputs in DIR")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"),
+                        help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="throughput drop in percent that counts as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        return 1 if compare(base, new, args.threshold) else 0
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    results = run(stages, args.pages, args.repeat, args.seed, args.keep)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+from functools import partial
+import argparse
+import json
+import sys
+import time
+
+import image_to_pdf_core as core
+import image_to_pdf_document as documents
+import image_to_pdf_export as export
+from image_to_pdf_pages import file_sources
+
+# Headless batch conversion:
+#
+#   python image_to_pdf_cli.py out.pdf=scans/batch1 other.pdf="photos/*.jpg"
+#   python image_to_pdf_cli.py --jobs jobs.jsonl
+#
+# Each line of a jobs file is {"output": "x.pdf", "inputs": ["dir", "*.png"]}.
+
+
+def parse_job(spec):
+    output, sep, pattern = spec.partition("=")
+    if not sep or not output or not pattern:
+        raise argparse.ArgumentTypeError(f"expected OUTPUT.pdf=INPUT, got {spec!r}")
+    return {"output": output, "inputs": [pattern]}
+
+
+def read_jobs(path):
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        jobs = []
+        for line in f:
+            line = line.strip()
+            if line:
+                jobs.append(json.loads(line))
+        return jobs
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run_job(job, pool, options, auto_adjust=True, **auto_options):
+    files = core.expand_inputs(job["inputs"])
+    if not files:
+        raise ValueError("no input images")
+    # Multi-page files become one source per page, only headers are read
+    sources = [source for path in files for source in file_sources(path)]
+
+    # Decode, adjust and encode run in the pool, only a few pages are in
+    # flight at once. Without auto adjust, JPEG files are embedded as is.
+    # Files repeated in the job, or copies of one file, are encoded once.
+    task = partial(export.encode_file, auto_adjust=auto_adjust, **auto_options)
+    return export.write_pdf(sources, job["output"], options, pool=pool, task=task,
+                            key=export.file_key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert images to A4 PDFs without the GUI")
+    parser.add_argument("jobs", nargs="*", type=parse_job, metavar="OUTPUT.pdf=INPUT",
+                        help="directory or glob of images to write into OUTPUT.pdf")
+    parser.add_argument("--jobs", dest="jobs_file", metavar="FILE",
+                        help="JSON lines file of jobs ('-' for stdin)")
+    parser.add_argument("--no-auto-adjust", action="store_true",
+                        help="skip auto rotate/enhance")
+    parser.add_argument("--document", action="store_true",
+                        help="also find the page in photos, crop and deskew it (needs NumPy)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="per-page levels, white balance and midtones instead of fixed factors")
+    parser.add_argument("--scan", choices=core.SCAN_MODES, default=None,
+                        help="convert pages to grayscale or black and white after adjusting")
+    parser.add_argument("--encoding", choices=export.ENCODINGS, default="flate",
+                        help="page image compression (default: lossless flate)")
+    parser.add_argument("--quality", type=int, default=85,
+                        help="JPEG quality for --encoding jpeg/auto")
+    parser.add_argument("--dpi", type=int, default=None,
+                        help="downsample pages above this resolution on the A4 page")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--threads", action="store_true",
+                        help="use a thread pool instead of processes")
+    args = parser.parse_args(argv)
+
+    jobs = list(args.jobs)
+    if args.jobs_file:
+        jobs.extend(read_jobs(args.jobs_file))
+    if not jobs:
+        parser.error("no jobs given")
+    if args.document and not documents.available():
+        parser.error("--document needs NumPy")
+
+    options = export.ExportOptions(args.encoding, args.quality, args.dpi)
+
+    failed = 0
+    total_pages = 0
+    started = time.perf_counter()
+
+    with core.make_pool(args.workers, processes=not args.threads) as pool:
+        for job in jobs:
+            t0 = time.perf_counter()
+            try:
+                count = run_job(job, pool, options, auto_adjust=not args.no_auto_adjust,
+                                document=args.document, adaptive=args.adaptive,
+                                scan=args.scan)
+            except Exception as e:
+                failed += 1
+                print(f"FAIL {job.get('output')}: {e}", file=sys.stderr)
+                continue
+            total_pages += count
+            print(f"ok   {job['output']}  {count} pages  {time.perf_counter() - t0:.3f}s")
+
+    elapsed = time.perf_counter() - started
+    print(f"{len(jobs) - failed}/{len(jobs)} jobs, {total_pages} pages in {elapsed:.3f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,435 @@
+from PIL import Image, ImageChops, ImageEnhance, ImageFilter, ImageOps
+from reportlab.lib.pagesizes import A4
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from functools import partial
+import multiprocessing
+import glob
+import math
+import os
+
+import image_to_pdf_document as documents
+import image_to_pdf_profile as profile
+
+# GUI-free image pipeline shared by the Tk app and the command line.
+
+# TIFF, GIF and PDF files may hold many pages, see image_to_pdf_pages
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".gif", ".pdf")
+
+# Pages keep these modes, so greyscale and bilevel scans stay small all the
+# way to the PDF; anything else is converted to RGB
+PAGE_MODES = ("RGB", "L", "1")
+
+
+# ---------------- Load ----------------
+def page_image(img):
+    # A loaded copy of img in one of PAGE_MODES
+    return img.convert(img.mode if img.mode in PAGE_MODES else "RGB")
+
+
+@profile.timed("decode")
+def load_image(path):
+    with Image.open(path) as img:
+        return page_image(img)
+
+
+def expand_inputs(inputs):
+    # Directories expand to their images, anything else is treated as a glob
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            names = sorted(os.listdir(pattern))
+            files.extend(
+                os.path.join(pattern, n) for n in names
+                if n.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        else:
+            matches = sorted(glob.glob(pattern))
+            files.extend(matches if matches else [pattern])
+    return files
+
+
+# ---------------- Edit Ops ----------------
+def rotate(img, angle):
+    return img.rotate(angle, expand=True)
+
+
+def crop(img, box):
+    return img.crop(box)
+
+
+# ITU-R 601 luma weights, the same ones convert("L") uses
+LUMA = (0.299, 0.587, 0.114)
+
+
+def enhance_chain(img, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0):
+    # Reference implementation, one full-size intermediate per step
+    img = ImageEnhance.Brightness(img).enhance(brightness)
+    img = ImageEnhance.Contrast(img).enhance(contrast)
+    img = ImageEnhance.Color(img).enhance(saturation)
+    img = ImageEnhance.Sharpness(img).enhance(sharpness)
+    return img
+
+
+def _brightened_mean(img, brightness):
+    # Mean luma after the brightness step, read off the histogram so no
+    # intermediate image is needed
+    hist = img.histogram()
+    means = []
+    for band in range(len(img.getbands())):
+        h = hist[band * 256:(band + 1) * 256]
+        total = sum(h) or 1
+        means.append(sum(n * min(255.0, v * brightness) for v, n in enumerate(h)) / total)
+    if len(means) == 1:
+        return means[0]
+    return sum(w * m for w, m in zip(LUMA, means))
+
+
+def _blend(base, value, alpha):
+    # One channel of Image.blend(base, value, alpha): extrapolation is
+    # clipped, and the result truncated
+    v = base + alpha * (value - base)
+    return 0 if v <= 0 else 255 if v >= 255 else int(v)
+
+
+@profile.timed("enhance")
+def enhance(img, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0):
+    # Fused version of enhance_chain. Brightness and contrast act on each
+    # channel value alone, so together they are one lookup table that
+    # clips between the steps just like the chain; saturation is one
+    # colour matrix pass and sharpness one 3x3 convolution. The results
+    # match the chain within the tolerance tests/test_enhance.py checks.
+    source = img
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("L" if img.mode == "1" else "RGB")
+
+    if (brightness, contrast) != (1.0, 1.0):
+        mean = int(_brightened_mean(img, brightness) + 0.5)
+        lut = [_blend(mean, _blend(0, v, brightness), contrast) for v in range(256)]
+        img = img.point(lut * len(img.getbands()))
+
+    if saturation != 1.0 and img.mode == "RGB":
+        # out = s * x + (1 - s) * luma(x), per channel
+        matrix = []
+        for row in range(3):
+            for col in range(3):
+                matrix.append((1.0 - saturation) * LUMA[col] + (saturation if row == col else 0.0))
+            matrix.append(0.0)
+        img = img.convert("RGB", tuple(matrix))
+
+    if sharpness != 1.0:
+        # blend(smooth, img, f) folded into a single kernel
+        side = (1.0 - sharpness) / 13
+        weights = [side] * 9
+        weights[4] = 5 * side + sharpness
+        img = img.filter(ImageFilter.Kernel((3, 3), weights, scale=1))
+
+    # Like ImageEnhance, never hand back the caller's image
+    return img.copy() if img is source else img
+
+
+# ---------------- Scan Mode ----------------
+SCAN_MODES = ("gray", "bilevel")
+
+
+def to_bilevel(img, radius=None, offset=12):
+    # Adaptive threshold: a pixel is ink when it is more than offset darker
+    # than the mean of its neighbourhood. Box blur, subtract and the 1-bit
+    # lookup all run in Pillow's C loops, whole image at a time.
+    gray = img if img.mode == "L" else img.convert("L")
+    radius = radius or max(8, min(gray.size) // 50)
+    local = gray.filter(ImageFilter.BoxBlur(radius))
+    ink = ImageChops.subtract(local, gray)
+    return ink.point([255 if v <= offset else 0 for v in range(256)], "1")
+
+
+@profile.timed("scan")
+def convert_scan(img, mode):
+    if mode == "gray":
+        return img.convert("L")
+    if mode == "bilevel":
+        return img.copy() if img.mode == "1" else to_bilevel(img)
+    raise ValueError(f"Unknown scan mode {mode!r}")
+
+
+# ---------------- Operations ----------------
+# Edits are recorded as small JSON-friendly dicts so they can be replayed:
+#   {"op": "rotate", "angle": 90}
+#   {"op": "crop", "box": [x1, y1, x2, y2]}
+#   {"op": "enhance", "brightness": 1.1, "contrast": 1.0, ...}
+#   {"op": "scan", "mode": "gray"}  (or "bilevel")
+#   {"op": "auto"}, optionally with "document": true, "adaptive": true
+#                   and "scan": "gray" / "bilevel"
+ENHANCE_PARAMS = ("brightness", "contrast", "saturation", "sharpness")
+AUTO_OPTIONS = ("document", "adaptive", "scan")
+
+
+def apply_op(img, op):
+    kind = op["op"]
+    if kind == "rotate":
+        return rotate(img, op["angle"])
+    if kind == "crop":
+        return crop(img, tuple(op["box"]))
+    if kind == "enhance":
+        return enhance(img, **{k: op[k] for k in ENHANCE_PARAMS if k in op})
+    if kind == "scan":
+        return convert_scan(img, op["mode"])
+    if kind == "auto":
+        return auto_adjust(img, **{k: op[k] for k in AUTO_OPTIONS if k in op})
+    raise ValueError(f"Unknown operation {kind!r}")
+
+
+def apply_ops(img, ops):
+    for op in ops:
+        img = apply_op(img, op)
+    return img
+
+
+def op_size(size, op):
+    # Size after op without rendering it, or None when that needs pixels
+    kind = op["op"]
+    if kind == "rotate":
+        turns = quarter_turns(op)
+        return None if turns is None else turned(size, turns)
+    if kind == "crop":
+        x0, y0, x1, y1 = op["box"]
+        return x1 - x0, y1 - y0
+    if kind in ("enhance", "scan"):
+        return tuple(size)
+    return None  # auto may turn (EXIF) or crop (document)
+
+
+# ---------------- Geometry ----------------
+# Quarter turns and crops are lossless. A run of them at the end of a page's
+# ops folds into one (box, turns) geometry: crop the image to box, then
+# turn it counter-clockwise turns times. Previews apply it to a screen-sized
+# image and the PDF export through the placement matrix, so the full-size
+# pixels are never rotated or cropped.
+TRANSPOSE_TURNS = {
+    1: Image.Transpose.ROTATE_90,
+    2: Image.Transpose.ROTATE_180,
+    3: Image.Transpose.ROTATE_270,
+}
+
+
+def quarter_turns(op):
+    if op["op"] == "rotate" and op["angle"] % 90 == 0:
+        return op["angle"] // 90 % 4
+    return None
+
+
+def is_geometry(op):
+    return op["op"] == "crop" or quarter_turns(op) is not None
+
+
+def geometry_start(ops):
+    # Index where the trailing run of geometry ops begins
+    pos = len(ops)
+    while pos > 0 and is_geometry(ops[pos - 1]):
+        pos -= 1
+    return pos
+
+
+def turned(size, turns):
+    return (size[1], size[0]) if turns % 2 else tuple(size)
+
+
+def unturn_box(box, size, turns):
+    # A box on the image turned turns times, mapped back onto the unturned
+    # image of the given size
+    x0, y0, x1, y1 = box
+    for step in range(turns, 0, -1):
+        width = size[0] if step % 2 else size[1]  # before this turn
+        x0, y0, x1, y1 = width - y1, x0, width - y0, x1
+    return x0, y0, x1, y1
+
+
+def fold_geometry(size, ops):
+    # The geometry of geometry-only ops on an image of this size, or None
+    # if a crop reaches outside the image (Image.crop pads those)
+    box = (0, 0, size[0], size[1])
+    turns = 0
+    for op in ops:
+        t = quarter_turns(op)
+        if t is not None:
+            turns = (turns + t) % 4
+            continue
+        w, h = box[2] - box[0], box[3] - box[1]
+        x0, y0, x1, y1 = unturn_box(op["box"], (w, h), turns)
+        if x0 < 0 or y0 < 0 or x1 > w or y1 > h or x1 <= x0 or y1 <= y0:
+            return None
+        box = (box[0] + x0, box[1] + y0, box[0] + x1, box[1] + y1)
+    return box, turns
+
+
+def scale_geometry(geometry, size, new_size):
+    # The same geometry for a resized copy of the image
+    (x0, y0, x1, y1), turns = geometry
+    sx, sy = new_size[0] / size[0], new_size[1] / size[1]
+    box = (round(x0 * sx), round(y0 * sy), round(x1 * sx), round(y1 * sy))
+    box = (box[0], box[1], max(box[2], box[0] + 1), max(box[3], box[1] + 1))
+    return box, turns
+
+
+def geometry_size(geometry):
+    (x0, y0, x1, y1), turns = geometry
+    return turned((x1 - x0, y1 - y0), turns)
+
+
+def apply_geometry(img, geometry):
+    box, turns = geometry
+    if box != (0, 0, img.width, img.height):
+        img = img.crop(box)
+    if turns:
+        img = img.transpose(TRANSPOSE_TURNS[turns])
+    return img
+
+
+# ---------------- Auto Adjust ----------------
+@profile.timed("exif_transpose")
+def auto_rotate(img):
+    try:
+        # This fixes camera-rotated images properly
+        img = ImageOps.exif_transpose(img)
+    except Exception:
+        pass
+    return img
+
+
+def auto_enhance(img):
+    # Gentle brightness, contrast (text clarity), saturation (ink visibility)
+    # and a slight sharpening
+    return enhance(img, brightness=1.05, contrast=1.25, saturation=1.1, sharpness=1.1)
+
+
+# Adaptive mode: levels, white balance and midtones per page, from one
+# histogram, applied as a single lookup table pass
+CLIP = 0.005  # fraction of pixels allowed to clip at each end
+MAX_STRETCH = (60, 160)  # black point never above, white point never below
+MAX_CAST = 20  # how far a channel's white point may be pulled to the others
+MIDTONE = 0.45  # darker medians are lifted with a gamma, lighter left alone
+
+
+def _percentile(h, fraction):
+    target = sum(h) * fraction
+    acc = 0
+    for v, n in enumerate(h):
+        acc += n
+        if acc > target:
+            return v
+    return 255
+
+
+def adaptive_lut(hist, bands):
+    # Per-channel lookup table (bands * 256 entries) for a histogram
+    channels = [hist[b * 256:(b + 1) * 256] for b in range(bands)]
+    lows = [min(_percentile(h, CLIP), MAX_STRETCH[0]) for h in channels]
+    highs = [max(_percentile(h, 1.0 - CLIP), MAX_STRETCH[1]) for h in channels]
+
+    # White balance: pull each white point towards the common one, a
+    # strong colour cast is more likely the subject than the light
+    white = sum(highs) / bands
+    highs = [min(max(hi, white - MAX_CAST), white + MAX_CAST) for hi in highs]
+
+    # Midtones: median of the levelled image
+    weights = LUMA if bands == 3 else (1.0,)
+    median = sum(
+        w * min(max((_percentile(h, 0.5) - lo) / (hi - lo), 0.0), 1.0)
+        for w, h, lo, hi in zip(weights, channels, lows, highs)
+    )
+    gamma = 1.0
+    if 0.0 < median < MIDTONE:
+        gamma = max(math.log(MIDTONE) / math.log(median), 0.6)
+
+    lut = []
+    for lo, hi in zip(lows, highs):
+        for v in range(256):
+            x = min(max((v - lo) / (hi - lo), 0.0), 1.0)
+            lut.append(int(255 * x ** gamma + 0.5))
+    return lut
+
+
+@profile.timed("adaptive_enhance")
+def adaptive_enhance(img):
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("L" if img.mode == "1" else "RGB")
+    return img.point(adaptive_lut(img.histogram(), len(img.getbands())))
+
+
+@profile.timed("document")
+def auto_document(img):
+    # Page detection, perspective crop and deskew; a no-op without NumPy
+    return documents.auto_document(img)
+
+
+@profile.timed("auto_adjust")
+def auto_adjust(img, document=False, adaptive=False, scan=None):
+    img = auto_rotate(img)
+    if img.mode == "1":
+        # Already black and white: there is no tone to adjust, and the page
+        # must stay bilevel to be CCITT encoded in the PDF. Straightening
+        # resamples in grey, then thresholds back.
+        if document:
+            img = auto_document(img.convert("L")).convert("1", dither=Image.Dither.NONE)
+        return convert_scan(img, scan) if scan else img
+    if document:
+        img = auto_document(img)
+    img = adaptive_enhance(img) if adaptive else auto_enhance(img)
+    return convert_scan(img, scan) if scan else img
+
+
+def auto_adjust_task(item, **options):
+    # item is a decoded image or a lazy page source with load()
+    if not isinstance(item, Image.Image):
+        item = item.load()
+    return auto_adjust(item, **options)
+
+
+# ---------------- Worker Pool ----------------
+def make_pool(workers=None, processes=True):
+    if processes:
+        # spawn, because forking a process that runs Tk threads is unsafe
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    # Pillow releases the GIL inside its C filters, so threads also scale
+    return ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+def pool_map(pool, fn, items, window=None):
+    # Ordered map with a bounded number of tasks in flight, so huge inputs
+    # stream through the pool instead of being submitted all at once
+    window = window or 2 * (getattr(pool, "_max_workers", None) or os.cpu_count())
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # The caller stopped early, e.g. cancelled
+        for future in pending:
+            future.cancel()
+
+
+def auto_adjust_all(items, pool, **options):
+    # The adjusted images in page order, as they come. items may be any
+    # iterable of images or lazy page sources (anything with load(), which
+    # then runs in the worker); it is consumed only as results are taken,
+    # so a few pages are decoded or held at a time whatever the page count.
+    # options are auto_adjust() keywords, see AUTO_OPTIONS
+    return pool_map(pool, partial(auto_adjust_task, **options), items)
+
+
+# ---------------- PDF ----------------
+def fit_to_page(size, pagesize=A4):
+    pw, ph = pagesize
+    iw, ih = size
+
+    scale = min(pw / iw, ph / ih)
+    nw, nh = iw * scale, ih * scale
+
+    return (pw - nw) / 2, (ph - nh) / 2, nw, nh
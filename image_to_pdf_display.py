@@ -0,0 +1,102 @@
+from PIL import ImageTk
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import image_to_pdf_profile as profile
+
+# Screen-sized renders of the current page and its neighbours.
+#
+# Entries are keyed by page id and remember the page version and the box
+# they were rendered for, so an edited page or a resized canvas simply
+# misses. A single background thread prefetches in the direction of
+# travel. PhotoImage handles can only be made on the Tk thread, so they
+# are created lazily in get() and then cached alongside the preview.
+
+
+class DisplayEntry:
+    def __init__(self, version, box, image):
+        self.version = version
+        self.box = box
+        self.image = image
+        self.photo = None
+
+
+class DisplayCache:
+    def __init__(self, ahead=3, behind=1):
+        self.ahead = ahead
+        self.behind = behind
+        self.box = None
+        self.entries = {}  # page id -> DisplayEntry
+        self.lock = threading.Lock()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.generation = 0
+
+    def set_box(self, box):
+        if box != self.box:
+            self.box = box
+            self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _valid(self, page):
+        entry = self.entries.get(page.id)
+        if entry and entry.version == page.version and entry.box == self.box:
+            return entry
+        return None
+
+    def get(self, page):
+        # Tk thread only. Returns (preview image, PhotoImage)
+        with self.lock:
+            entry = self._valid(page)
+
+        if entry is None:
+            entry = DisplayEntry(page.version, self.box, page.preview(self.box))
+            with self.lock:
+                self.entries[page.id] = entry
+
+        if entry.photo is None:
+            entry.photo = ImageTk.PhotoImage(entry.image)
+        return entry.image, entry.photo
+
+    def prefetch(self, pages, index, direction=1):
+        # Drop everything outside the window, then warm the neighbours,
+        # nearest first in the direction of travel
+        direction = 1 if direction >= 0 else -1
+        self.generation += 1
+        generation = self.generation
+
+        lo = index - (self.behind if direction > 0 else self.ahead)
+        hi = index + (self.ahead if direction > 0 else self.behind)
+        window = {p.id for p in pages[max(lo, 0):hi + 1]}
+        with self.lock:
+            for page_id in [k for k in self.entries if k not in window]:
+                del self.entries[page_id]
+
+        order = [index + direction * i for i in range(1, self.ahead + 1)]
+        order += [index - direction * i for i in range(1, self.behind + 1)]
+        box = self.box
+
+        for i in order:
+            if 0 <= i < len(pages):
+                self.worker.submit(self._warm, pages[i], box, generation)
+
+    @profile.timed("prefetch")
+    def _warm(self, page, box, generation):
+        if generation != self.generation or box != self.box:
+            return  # the user has moved on
+
+        with self.lock:
+            if self._valid(page):
+                return
+
+        version = page.version
+        image = page.preview(box)
+
+        with self.lock:
+            if box == self.box:
+                self.entries[page.id] = DisplayEntry(version, box, image)
+
+    def close(self):
+        self.worker.shutdown(wait=False, cancel_futures=True)
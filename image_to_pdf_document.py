@@ -0,0 +1,144 @@
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # document detection is optional
+    np = None
+
+# Automatic document detection for photographed pages.
+#
+# All analysis runs on a greyscale proxy of at most PROXY_SIZE pixels a
+# side; only the final transform touches the full resolution image, once.
+#   - If the page stands out as a bright quadrilateral against a darker
+#     background, its corners are found and the page is cropped and
+#     straightened with a single perspective (QUAD) transform.
+#   - Otherwise (scans, pages filling the frame) the skew of the text lines
+#     is measured with a projection profile and rotated out.
+# Needs NumPy; without it auto_document() leaves images untouched.
+
+PROXY_SIZE = 512
+MAX_SKEW = 10.0  # degrees either way
+MIN_SKEW = 0.2  # smaller angles are left alone
+
+
+def available():
+    return np is not None
+
+
+def proxy(img):
+    # Reduced greyscale copy as uint8, plus the scale back to full size
+    factor = max(1, max(img.size) // PROXY_SIZE)
+    small = img.reduce(factor) if factor > 1 else img
+    gray = np.asarray(small.convert("L"))
+    return gray, (img.width / small.width, img.height / small.height)
+
+
+def otsu(gray):
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    p = hist / hist.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    return int(np.nanargmax(between))
+
+
+# ---------------- Page outline ----------------
+def quad_area(quad):
+    # Shoelace formula, corners in order
+    xs = np.array([p[0] for p in quad])
+    ys = np.array([p[1] for p in quad])
+    return 0.5 * abs(np.dot(xs, np.roll(ys, 1)) - np.dot(ys, np.roll(xs, 1)))
+
+
+def find_quad(gray):
+    # Corners (top-left, bottom-left, bottom-right, top-right) of a bright
+    # page on a darker background, in proxy pixels, or None
+    h, w = gray.shape
+    mask = gray > otsu(gray)
+
+    covered = mask.mean()
+    if covered > 0.9 or covered < 0.15:
+        return None  # page fills the frame, or there is no page
+
+    # Ignore bright specks outside the rows and columns the page spans
+    rows = np.flatnonzero(mask.mean(axis=1) > 0.2)
+    cols = np.flatnonzero(mask.mean(axis=0) > 0.2)
+    if len(rows) < 2 or len(cols) < 2:
+        return None
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    ys, xs = np.nonzero(mask)
+    ys = ys + rows[0]
+    xs = xs + cols[0]
+
+    # Paper area with the printed content filled in, row by row
+    first = np.argmax(mask, axis=1)
+    last = mask.shape[1] - 1 - np.argmax(mask[:, ::-1], axis=1)
+    filled = np.where(mask.any(axis=1), last - first + 1, 0).sum()
+
+    s, d = xs + ys, xs - ys
+    corners = [np.argmin(s), np.argmin(d), np.argmax(s), np.argmax(d)]
+    quad = [(float(xs[i]), float(ys[i])) for i in corners]
+
+    # The page must be a big, mostly solid quadrilateral that does not
+    # already fill the frame
+    area = quad_area(quad)
+    if area < 0.2 * w * h or area > 0.95 * w * h:
+        return None
+    if not 0.85 < filled / area < 1.15:
+        return None
+    return quad
+
+
+# ---------------- Skew ----------------
+def skew_angle(gray):
+    # Angle in degrees that img.rotate() needs to level the text lines:
+    # the one that makes the row profile of the ink pixels the sharpest
+    h, w = gray.shape
+    ys, xs = np.nonzero(gray < otsu(gray))
+    if len(xs) < 100 or len(xs) > 0.5 * gray.size:
+        return 0.0
+
+    step = max(1, len(xs) // 20000)
+    x = xs[::step] - w / 2.0
+    y = ys[::step] - h / 2.0
+
+    def best(angles):
+        rad = np.deg2rad(angles)
+        proj = np.outer(np.cos(rad), y) + np.outer(np.sin(rad), x)
+        proj = np.rint(proj - proj.min()).astype(np.int64)
+        length = int(proj.max()) + 1
+        proj += np.arange(len(angles))[:, None] * length
+        counts = np.bincount(proj.ravel(), minlength=len(angles) * length)
+        scores = (counts.reshape(len(angles), length).astype(np.float64) ** 2).sum(axis=1)
+        return angles[int(np.argmax(scores))]
+
+    coarse = best(np.arange(-MAX_SKEW, MAX_SKEW + 0.25, 0.5))
+    fine = best(np.arange(coarse - 0.5, coarse + 0.55, 0.1))
+    return float(-fine)
+
+
+# ---------------- Apply ----------------
+def auto_document(img):
+    if np is None:
+        return img
+
+    gray, (sx, sy) = proxy(img)
+
+    quad = find_quad(gray)
+    if quad is not None:
+        tl, bl, br, tr = [((x + 0.5) * sx, (y + 0.5) * sy) for x, y in quad]
+        width = round((_dist(tl, tr) + _dist(bl, br)) / 2)
+        height = round((_dist(tl, bl) + _dist(tr, br)) / 2)
+        data = (*tl, *bl, *br, *tr)
+        return img.transform((width, height), Image.Transform.QUAD, data,
+                             resample=Image.Resampling.BICUBIC)
+
+    angle = skew_angle(gray)
+    if abs(angle) < MIN_SKEW:
+        return img
+    return img.rotate(angle, resample=Image.Resampling.BICUBIC, fillcolor="white")
+
+
+def _dist(a, b):
+    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
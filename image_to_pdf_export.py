@@ -0,0 +1,533 @@
+from PIL import Image, features
+import image_to_pdf_core as core
+import image_to_pdf_profile as profile
+from image_to_pdf_pages import FileSource, file_digest, pixels_key, source_digest
+from image_to_pdf_store import content_key, default_store, pack, unpack
+from functools import partial
+import hashlib
+import io
+import itertools
+import json
+import os
+import zlib
+
+# Streaming PDF export.
+#
+# Pages are encoded and written to the file one at a time, so memory use
+# does not grow with the page count. Each page image is stored with the
+# chosen filter:
+#   jpeg   DCTDecode at ExportOptions.quality
+#   flate  lossless FlateDecode (the old behaviour)
+#   auto   CCITT G4 for bilevel pages, Flate for other lossless-friendly
+#          modes, JPEG for colour
+# Pages larger than the A4 placement needs at ExportOptions.dpi are
+# downsampled first. Untouched JPEG files skip all of this and have their
+# original bytes embedded as they are; so do JPEG pages that were only
+# turned by quarter turns and cropped, the page content then places the
+# image through a matrix and clips it to the crop.
+#
+# Repeated pages (cover sheets, separators, a form shot twice) are encoded
+# once when write_pdf is given a content key, and the writer stores any
+# identical image data once, as one XObject shared by all its pages.
+#
+# Encoded pages are also kept in the disk store (image_to_pdf_store), keyed
+# by source, ops and options, so exporting again after changing one page
+# only encodes that page.
+
+ENCODINGS = ("flate", "jpeg", "auto")
+
+
+class ExportOptions:
+    def __init__(self, encoding="flate", quality=85, dpi=None, pagesize=core.A4):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}")
+        self.encoding = encoding
+        self.quality = quality
+        self.dpi = dpi
+        self.pagesize = pagesize
+
+
+# ---------------- Encoding ----------------
+class EncodedImage:
+    # A ready-to-write image XObject; plain data, so it pickles cheaply.
+    # geometry is the (box, turns) to place it with, see core.fold_geometry
+    def __init__(self, width, height, colorspace, bpc, filter, data, parms=None, geometry=None):
+        self.width = width
+        self.height = height
+        self.colorspace = colorspace
+        self.bpc = bpc
+        self.filter = filter
+        self.data = data
+        self.parms = parms
+        self.geometry = geometry
+
+
+def target_size(size, options):
+    # Pixel size needed for the A4 placement at options.dpi, or None when
+    # the image is already small enough
+    if not options.dpi:
+        return None
+    _, _, w, h = core.fit_to_page(size, options.pagesize)
+    tw = max(1, round(w / 72 * options.dpi))
+    th = max(1, round(h / 72 * options.dpi))
+    if size[0] <= tw and size[1] <= th:
+        return None
+    return tw, th
+
+
+def downsample(img, options):
+    size = target_size(img.size, options)
+    if size is None:
+        return img
+    tw, th = size
+    if img.mode == "1":
+        # Resample in grey and threshold back, NEAREST drops thin strokes
+        grey = img.convert("L").resize((tw, th), Image.Resampling.BOX)
+        return grey.convert("1", dither=Image.Dither.NONE)
+    return img.resize((tw, th), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+def encode_jpeg(img, quality):
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    return EncodedImage(img.width, img.height, colorspace, 8, "DCTDecode", buf.getvalue())
+
+
+def encode_flate(img):
+    if img.mode == "1":
+        # tobytes() packs rows MSB first with 1 = white, as DeviceGray wants
+        return EncodedImage(img.width, img.height, "DeviceGray", 1, "FlateDecode",
+                            zlib.compress(img.tobytes()))
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    colorspace = "DeviceGray" if img.mode == "L" else "DeviceRGB"
+    return EncodedImage(img.width, img.height, colorspace, 8, "FlateDecode",
+                        zlib.compress(img.tobytes()))
+
+
+def encode_ccitt(img):
+    # Group 4 fax via libtiff, falls back to Flate when it is unavailable
+    if not features.check("libtiff"):
+        return encode_flate(img)
+
+    buf = io.BytesIO()
+    img.save(buf, format="TIFF", compression="group4", tiffinfo={278: img.height})
+    buf.seek(0)
+    with Image.open(buf) as tif:
+        offsets = tif.tag_v2.get(273)
+        counts = tif.tag_v2.get(279)
+        photometric = tif.tag_v2.get(262, 0)
+    if not offsets or len(offsets) != 1:
+        return encode_flate(img)
+
+    data = buf.getvalue()[offsets[0]:offsets[0] + counts[0]]
+    parms = {
+        "K": -1,
+        "Columns": img.width,
+        "Rows": img.height,
+        # Pillow writes min-is-black, so CCITT "white" runs are black pixels
+        "BlackIs1": photometric == 1,
+    }
+    return EncodedImage(img.width, img.height, "DeviceGray", 1, "CCITTFaxDecode", data, parms)
+
+
+def encode_image(img, encoding="flate", quality=85):
+    if encoding == "jpeg":
+        return encode_ccitt(img) if img.mode == "1" else encode_jpeg(img, quality)
+    if encoding == "auto":
+        if img.mode == "1":
+            return encode_ccitt(img)
+        if img.mode == "L":
+            return encode_flate(img)
+        return encode_jpeg(img, quality)
+    return encode_flate(img)
+
+
+@profile.timed("pdf_encode")
+def encode_page(img, options):
+    # All the expensive per-page work: resample and compress
+    img = downsample(img, options)
+    return encode_image(img, options.encoding, options.quality)
+
+
+@profile.timed("pdf_passthrough")
+def jpeg_passthrough(path, options, geometry=None):
+    # The original DCT bytes of a JPEG file (a path or a binary file
+    # object), embedded without decoding and placed with geometry, or None
+    # when the file has to go through the normal path
+    try:
+        with Image.open(path) as f:
+            if f.format != "JPEG" or f.mode not in ("RGB", "L"):
+                return None  # CMYK JPEGs need Adobe inversion handling
+            size, mode = f.size, f.mode
+    except Exception:
+        return None
+
+    shown = core.geometry_size(geometry) if geometry else size
+    if target_size(shown, options) is not None:
+        return None  # the caller asked for a lower resolution
+
+    if isinstance(path, str):
+        with open(path, "rb") as fh:
+            data = fh.read()
+    else:
+        path.seek(0)
+        data = path.read()
+    colorspace = "DeviceGray" if mode == "L" else "DeviceRGB"
+    return EncodedImage(size[0], size[1], colorspace, 8, "DCTDecode", data, geometry=geometry)
+
+
+def page_item(page, options):
+    # What write_pdf should get for a page: passthrough bytes for a JPEG
+    # file that is untouched or only turned and cropped, otherwise its pixels
+    ops = page.ops
+    geometry = None
+    if ops:
+        if core.geometry_start(ops) > 0:
+            return page.image
+        geometry = core.fold_geometry(page.source_size, ops)
+        if geometry is None:
+            return page.image
+
+    source = page.source
+    whole = getattr(source, "frame", None) is None  # not a page of a multi-page file
+    enc = None
+    if whole and hasattr(source, "path"):
+        enc = jpeg_passthrough(source.path, options, geometry)
+    elif whole and getattr(source, "member", "").lower().endswith((".jpg", ".jpeg")):
+        # JPEG stored inside a project file
+        enc = jpeg_passthrough(io.BytesIO(source.read_bytes()), options, geometry)
+    return enc if enc is not None else page.image
+
+
+# Content keys for write_pdf: items with the same key come out the same
+def page_key(page):
+    # Page or PageSnapshot: source bytes plus ops
+    digest = source_digest(page.source)
+    if digest is None:
+        return None
+    return digest, json.dumps(page.ops, sort_keys=True)
+
+
+def file_key(item):
+    # A file path or source, as encode_file takes
+    try:
+        return source_digest(item) if hasattr(item, "load") else file_digest(item)
+    except OSError:
+        return None  # left to the task to report
+
+
+# ---------------- Disk store ----------------
+def encoded_key(source, ops, options):
+    # Store key of the page encode_page makes of source with ops applied
+    if not default_store().enabled:
+        return None
+    digest = source_digest(source)
+    if digest is None:
+        return None
+    return content_key("pdf", digest, ops, encoding=options.encoding, quality=options.quality,
+                       dpi=options.dpi, pagesize=list(options.pagesize))
+
+
+def get_encoded(key):
+    data = default_store().get(key)
+    if data is None:
+        return None
+    try:
+        header, payload = unpack(data)
+        return EncodedImage(header["width"], header["height"], header["colorspace"],
+                            header["bpc"], header["filter"], payload, header["parms"])
+    except (ValueError, KeyError):
+        return None  # unreadable, encoded again and replaced
+
+
+def put_encoded(key, enc):
+    # Only what encode_page makes: no geometry, passthrough is never stored
+    header = {k: getattr(enc, k) for k in ("width", "height", "colorspace", "bpc", "filter", "parms")}
+    default_store().put(key, pack(header, enc.data))
+
+
+# Pool tasks. Each returns an EncodedImage, so only compressed bytes come
+# back to the writer.
+def encode_item(item, options):
+    if isinstance(item, EncodedImage):
+        return item
+    return encode_page(item, options)
+
+
+def encode_page_task(page, options):
+    # page is a Page or PageSnapshot. Decodes lazily in the worker too;
+    # pages do not pickle, threads only
+    key = encoded_key(page.source, page.ops, options)
+    enc = get_encoded(key)
+    if enc is None:
+        item = page_item(page, options)
+        if isinstance(item, EncodedImage):
+            return item
+        enc = encode_page(item, options)
+        put_encoded(key, enc)
+    return enc
+
+
+def encode_file(path, options, auto_adjust=False, **auto_options):
+    # path may also be a FileSource, e.g. one page of a multi-page file
+    source = path if isinstance(path, FileSource) else FileSource(path)
+    if not auto_adjust and source.frame is None:
+        enc = jpeg_passthrough(source.path, options)
+        if enc is not None:
+            return enc
+
+    # Recorded like the app's Auto Adjust, so both share store entries
+    ops = [{"op": "auto", **{k: v for k, v in auto_options.items() if v}}] if auto_adjust else []
+    key = encoded_key(source, ops, options)
+    enc = get_encoded(key)
+    if enc is not None:
+        return enc
+    if auto_adjust:
+        # The adjusted pixels too, for an export with other options
+        store = default_store()
+        key_img = pixels_key(source, ops) if store.enabled else None
+        img = store.cached_image(key_img, lambda: core.auto_adjust(source.load(), **auto_options))
+    else:
+        img = source.load()
+    enc = encode_page(img, options)
+    put_encoded(key, enc)
+    return enc
+
+
+# ---------------- Writer ----------------
+def pdf_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return fmt(value)
+    return str(value)
+
+
+def fmt(number):
+    if isinstance(number, int):
+        return str(number)
+    return f"{number:.4f}".rstrip("0").rstrip(".")
+
+
+class PdfWriter:
+    # Minimal PDF 1.4 writer. Objects go straight to disk; only their
+    # offsets are kept until the cross-reference table at the end.
+    # Writes to path + ".part" and renames on close, so a failed export
+    # never leaves a truncated PDF behind.
+
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".part"
+        self.f = open(self.tmp_path, "wb")
+        self.offsets = {}
+        self.next_num = 3
+        self.page_nums = []
+        self.images = {}  # image data fingerprint -> object number
+
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _reserve(self):
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def _write_obj(self, num, body):
+        self.offsets[num] = self.f.tell()
+        self.f.write(f"{num} 0 obj\n".encode())
+        self.f.write(body)
+        self.f.write(b"\nendobj\n")
+
+    def _write_stream(self, num, entries, data):
+        entries = dict(entries, Length=len(data))
+        head = "<< " + " ".join(f"/{k} {pdf_value(v)}" for k, v in entries.items()) + " >>"
+        self._write_obj(num, head.encode() + b"\nstream\n" + data + b"\nendstream")
+
+    def add_image(self, enc):
+        # Identical images are written once and shared by their pages
+        fingerprint = (
+            hashlib.sha1(enc.data).digest(), enc.width, enc.height, enc.colorspace,
+            enc.bpc, enc.filter, tuple(sorted((enc.parms or {}).items()))
+        )
+        num = self.images.get(fingerprint)
+        if num is not None:
+            profile.count("pdf_shared_images")
+            return num
+
+        num = self.images[fingerprint] = self._reserve()
+        entries = {
+            "Type": "/XObject",
+            "Subtype": "/Image",
+            "Width": enc.width,
+            "Height": enc.height,
+            "ColorSpace": "/" + enc.colorspace,
+            "BitsPerComponent": enc.bpc,
+            "Filter": "/" + enc.filter,
+        }
+        if enc.parms:
+            entries["DecodeParms"] = "<< " + " ".join(
+                f"/{k} {pdf_value(v)}" for k, v in enc.parms.items()
+            ) + " >>"
+        with profile.stage("pdf_write"):
+            self._write_stream(num, entries, enc.data)
+        profile.count("pdf_image_bytes", len(enc.data))
+        return num
+
+    def add_page(self, pagesize, content, xobjects):
+        # xobjects maps resource names used in content to image numbers
+        content_num = self._reserve()
+        self._write_stream(content_num, {}, content)
+
+        resources = " ".join(f"/{name} {num} 0 R" for name, num in xobjects.items())
+        page = (
+            f"<< /Type /Page /Parent {self.PAGES} 0 R "
+            f"/MediaBox [0 0 {fmt(pagesize[0])} {fmt(pagesize[1])}] "
+            f"/Resources << /XObject << {resources} >> >> "
+            f"/Contents {content_num} 0 R >>"
+        )
+        num = self._reserve()
+        self._write_obj(num, page.encode())
+        self.page_nums.append(num)
+        return num
+
+    def close(self):
+        if self.f.closed:
+            return
+        kids = " ".join(f"{n} 0 R" for n in self.page_nums)
+        self._write_obj(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_nums)} >>".encode())
+        self._write_obj(self.CATALOG, f"<< /Type /Catalog /Pages {self.PAGES} 0 R >>".encode())
+
+        xref = self.f.tell()
+        size = self.next_num
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for num in range(1, size):
+            lines.append(f"{self.offsets.get(num, 0):010d} 00000 n \n")
+        self.f.write("".join(lines).encode())
+        self.f.write(f"trailer\n<< /Size {size} /Root {self.CATALOG} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.f.closed:
+            return
+        self.f.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def place_image(pagesize, image_size, name="Im0", geometry=None):
+    # Content stream drawing the image fitted and centred on the page. With
+    # a geometry, only its box shows: the matrix turns and scales the whole
+    # image so the box lands on the placement, which is then the clip.
+    if geometry is None:
+        x, y, w, h = core.fit_to_page(image_size, pagesize)
+        return f"q {fmt(w)} 0 0 {fmt(h)} {fmt(x)} {fmt(y)} cm /{name} Do Q".encode()
+
+    box, turns = geometry
+    dw, dh = core.geometry_size(geometry)
+    x, y, w, h = core.fit_to_page((dw, dh), pagesize)
+
+    def to_page(px, py):
+        # Image pixel corner -> page point
+        cx, cy = px - box[0], py - box[1]
+        width, height = box[2] - box[0], box[3] - box[1]
+        for _ in range(turns):
+            cx, cy = cy, width - cx
+            width, height = height, width
+        return x + cx * w / dw, y + h - cy * h / dh
+
+    # The image unit square has its origin at the bottom-left pixel corner
+    iw, ih = image_size
+    ox, oy = to_page(0, ih)
+    ux, uy = to_page(iw, ih)
+    vx, vy = to_page(0, 0)
+    matrix = " ".join(fmt(v) for v in (ux - ox, uy - oy, vx - ox, vy - oy, ox, oy))
+    return (
+        f"q {fmt(x)} {fmt(y)} {fmt(w)} {fmt(h)} re W n "
+        f"{matrix} cm /{name} Do Q"
+    ).encode()
+
+
+def write_encoded_page(writer, enc, pagesize):
+    num = writer.add_image(enc)
+    content = place_image(pagesize, (enc.width, enc.height), geometry=enc.geometry)
+    writer.add_page(pagesize, content, {"Im0": num})
+    return num
+
+
+def dedupe(items, key):
+    # (unique items, index into them for every item)
+    unique, order, first = [], [], {}
+    for item in items:
+        k = key(item)
+        if k is not None and k in first:
+            order.append(first[k])
+            continue
+        if k is not None:
+            first[k] = len(unique)
+        order.append(len(unique))
+        unique.append(item)
+    return unique, order
+
+
+# ---------------- Export ----------------
+def write_pdf(items, path, options=None, pool=None, task=encode_item,
+              progress=None, cancel=None, key=None):
+    # items may be any iterable; task(item, options) turns each into an
+    # EncodedImage. With a pool the tasks run in parallel with a bounded
+    # number in flight, while this thread writes the results in page
+    # order, so the file is byte-for-byte the same as a serial export.
+    # key(item), e.g. page_key or file_key, names an item's content: items
+    # with the same key are encoded once and placed again.
+    # Returns the page count, or None if cancel (an Event) was set; then
+    # no file is left behind.
+    options = options or ExportOptions()
+    task = partial(task, options=options)
+    total = len(items) if hasattr(items, "__len__") else None
+    order = itertools.count()
+    if key is not None:
+        items, order = dedupe(items, key)
+        total = len(order)
+    encoded = core.pool_map(pool, task, items) if pool else map(task, items)
+    placed = []  # (image size, geometry, image number) per unique item
+    count = 0
+
+    with profile.stage("pdf_export"), PdfWriter(path) as writer:
+        for index in order:
+            if index == len(placed):
+                enc = next(encoded, None)
+                if enc is None:
+                    break
+                num = write_encoded_page(writer, enc, options.pagesize)
+                placed.append(((enc.width, enc.height), enc.geometry, num))
+            else:
+                size, geometry, num = placed[index]
+                content = place_image(options.pagesize, size, geometry=geometry)
+                writer.add_page(options.pagesize, content, {"Im0": num})
+                profile.count("pdf_repeated_pages")
+            if cancel is not None and cancel.is_set():
+                writer.abort()
+                return None
+            count += 1
+            if progress:
+                progress(count, total)
+
+    return count
@@ -0,0 +1,151 @@
+from tkinter import ttk
+import tkinter as tk
+from PIL import ImageTk
+from image_to_pdf_thumbs import THUMB_SIZE
+
+# Scrollable strip of page thumbnails.
+#
+# Cells have a fixed size, so the scroll region is known without looking
+# at any page. Only the cells in view (plus a small margin) have canvas
+# items; thumbnails for them are requested from the ThumbnailCache and
+# drawn when they arrive, so a 1000 page job scrolls as fast as a short one.
+
+
+class Filmstrip:
+    PAD = 8
+    CELL_W = THUMB_SIZE[0] + 2 * PAD
+    CELL_H = THUMB_SIZE[1] + 2 * PAD + 14
+    MARGIN = 2  # cells rendered beyond each edge of the view
+
+    def __init__(self, parent, thumbs, on_select):
+        self.thumbs = thumbs
+        self.on_select = on_select
+        self.pages = []
+        self.current = 0
+        self.cells = {}  # index -> (page key, PhotoImage or None)
+        self.layout_pending = False
+
+        self.frame = ttk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=self.CELL_H, bg="#333", highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self._xview)
+        self.canvas.configure(xscrollcommand=self.scrollbar.set)
+        self.canvas.pack(fill=tk.X)
+        self.scrollbar.pack(fill=tk.X)
+
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self._scroll(-1 if e.delta > 0 else 1))
+        self.canvas.bind("<Button-4>", lambda e: self._scroll(-1))
+        self.canvas.bind("<Button-5>", lambda e: self._scroll(1))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def set_pages(self, pages):
+        # pages is the app's list, kept by reference
+        self.pages = pages
+        self.current = min(self.current, max(len(pages) - 1, 0))
+        self.canvas.delete("all")
+        self.cells.clear()
+        self.canvas.configure(scrollregion=(0, 0, len(pages) * self.CELL_W, self.CELL_H))
+        self.refresh()
+
+    def select(self, index):
+        old, self.current = self.current, index
+        self._outline(old)
+        self._outline(index)
+
+        # Scroll just enough to bring the current page into view
+        x0 = self.canvas.canvasx(0)
+        width = self.canvas.winfo_width()
+        left = index * self.CELL_W
+        if left < x0 or left + self.CELL_W > x0 + width:
+            total = max(len(self.pages) * self.CELL_W, 1)
+            self.canvas.xview_moveto(max(left - (width - self.CELL_W) / 2, 0) / total)
+        self.refresh()
+
+    def refresh(self):
+        # Coalesced, pages may have been edited, replaced or scrolled
+        if not self.layout_pending:
+            self.layout_pending = True
+            self.canvas.after_idle(self._layout)
+
+    def _xview(self, *args):
+        self.canvas.xview(*args)
+        self.refresh()
+
+    def _scroll(self, units):
+        self.canvas.xview_scroll(units, "units")
+        self.refresh()
+
+    def _on_click(self, e):
+        index = int(self.canvas.canvasx(e.x) // self.CELL_W)
+        if 0 <= index < len(self.pages):
+            self.on_select(index)
+
+    def visible_range(self):
+        x0 = self.canvas.canvasx(0)
+        first = int(x0 // self.CELL_W) - self.MARGIN
+        last = int((x0 + self.canvas.winfo_width()) // self.CELL_W) + self.MARGIN
+        return max(first, 0), min(last, len(self.pages) - 1)
+
+    def _layout(self):
+        self.layout_pending = False
+        first, last = self.visible_range()
+
+        for index in [i for i in self.cells if not first <= i <= last]:
+            self._drop(index)
+
+        # Pages scrolled away before their turn are not rendered at all
+        self.thumbs.begin()
+        for index in range(first, last + 1):
+            page = self.pages[index]
+            cell = self.cells.get(index)
+            if cell and cell[0] == (page.id, page.version) and cell[1]:
+                continue
+            if cell is None or cell[0] != (page.id, page.version):
+                self._draw_placeholder(index, page)
+            img = self.thumbs.peek(page)
+            if img is not None:
+                self._draw_thumb(index, page, img)
+            else:
+                self.thumbs.request(page, self._thumb_ready)
+
+    def _thumb_ready(self, page):
+        # Worker thread, hand over to Tk
+        self.canvas.after(0, self.refresh)
+
+    def _drop(self, index):
+        self.canvas.delete(f"cell{index}")
+        self.cells.pop(index, None)
+
+    def _draw_placeholder(self, index, page):
+        self._drop(index)
+        x = index * self.CELL_W
+        tag = f"cell{index}"
+        self.canvas.create_rectangle(
+            x + self.PAD, self.PAD, x + self.CELL_W - self.PAD, self.PAD + THUMB_SIZE[1],
+            fill="#555", outline="", tags=(tag,)
+        )
+        self.canvas.create_text(
+            x + self.CELL_W / 2, self.CELL_H - self.PAD - 6,
+            text=str(index + 1), fill="#ddd", tags=(tag,)
+        )
+        self.canvas.create_rectangle(
+            x + 2, 2, x + self.CELL_W - 2, self.CELL_H - 2,
+            outline="", width=3, tags=(tag, f"outline{index}")
+        )
+        self.cells[index] = ((page.id, page.version), None)
+        self._outline(index)
+
+    def _draw_thumb(self, index, page, img):
+        photo = ImageTk.PhotoImage(img)
+        x = index * self.CELL_W + self.CELL_W / 2
+        y = self.PAD + THUMB_SIZE[1] / 2
+        self.canvas.create_image(x, y, image=photo, tags=(f"cell{index}",))
+        self.canvas.tag_raise(f"outline{index}")
+        self.cells[index] = ((page.id, page.version), photo)
+
+    def _outline(self, index):
+        color = "#f0c040" if index == self.current else ""
+        self.canvas.itemconfigure(f"outline{index}", outline=color)
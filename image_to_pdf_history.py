@@ -0,0 +1,211 @@
+from PIL import Image
+from collections import OrderedDict
+import image_to_pdf_core as core
+import image_to_pdf_profile as profile
+import atexit
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+
+# Undo/redo history stored as a list of edit operations per page.
+#
+# Full images are kept only as keyframes: the page's base image, plus one
+# every KEYFRAME_EVERY operations so undo never replays a long chain.
+# All keyframes share one memory budget (ITP_HISTORY_MB). Once it is
+# exceeded, the least recently used keyframes are spilled to a temporary
+# directory as fast-compressed PNGs. A page's base can also be a lazy
+# source, which is decoded on demand and never counted.
+#
+# Keyframes are read from the prefetch, thumbnail, zoom and job threads
+# while the Tk thread adds and spills them: the store's lock guards the
+# LRU list and every keyframe's switch from pixels to spill file.
+
+KEYFRAME_EVERY = 8
+
+
+class Keyframe:
+    def __init__(self, store, img=None, source=None):
+        self.store = store
+        self.id = next(store.ids)
+        self.image = img
+        self.source = source
+        self.path = None
+        self.nbytes = img.width * img.height * len(img.getbands()) if img else 0
+
+    def get(self):
+        if self.source is not None:
+            # Base of a lazy page, decoded from its source on demand
+            return self.source.load()
+
+        with self.store.lock:
+            img, path = self.image, self.path
+        if img is not None:
+            self.store.touch(self)
+            return img
+
+        # Spilled keyframes are read back on demand and stay on disk
+        with Image.open(path) as f:
+            f.load()
+            return f.copy()
+
+    @profile.timed("history_spill")
+    def spill(self, directory):
+        # Readers keep getting the pixels until the file is complete
+        img = self.image
+        if img is None:
+            return  # discarded meanwhile
+        path = os.path.join(directory, f"{self.id}.png")
+        img.save(path, format="PNG", compress_level=1)
+        with self.store.lock:
+            if self.image is not None:
+                self.path, self.image = path, None
+                return
+        _remove(path)
+
+    def discard(self):
+        self.store.forget(self)
+        with self.store.lock:
+            path, self.path = self.path, None
+            self.image = None
+            self.source = None
+        if path:
+            _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class HistoryStore:
+    def __init__(self, budget_bytes=None):
+        if budget_bytes is None:
+            budget_bytes = int(os.environ.get("ITP_HISTORY_MB", "1024")) * 1024 * 1024
+
+        self.budget = budget_bytes
+        self.ids = itertools.count()
+        self.in_memory = OrderedDict()  # id -> Keyframe, least recent first
+        self.used = 0
+        self.spill_dir = None
+        self.lock = threading.Lock()
+
+    def new_page(self, base):
+        # base is a decoded image or a page source with load()
+        return PageHistory(self, base)
+
+    def keyframe(self, img):
+        kf = Keyframe(self, img)
+        with self.lock:
+            self.in_memory[kf.id] = kf
+            self.used += kf.nbytes
+        self.enforce_budget()
+        return kf
+
+    def touch(self, kf):
+        with self.lock:
+            if kf.id in self.in_memory:  # not being spilled
+                self.in_memory.move_to_end(kf.id)
+
+    def forget(self, kf):
+        with self.lock:
+            if self.in_memory.pop(kf.id, None) is not None:
+                self.used -= kf.nbytes
+
+    def enforce_budget(self):
+        # Always keep the newest keyframe in memory, it is the one in use.
+        # Keyframes leave the list under the lock and are written after it
+        while True:
+            with self.lock:
+                if self.used <= self.budget or len(self.in_memory) <= 1:
+                    return
+                _, kf = self.in_memory.popitem(last=False)
+                self.used -= kf.nbytes
+                if self.spill_dir is None:
+                    self.spill_dir = tempfile.mkdtemp(prefix="itp-history-")
+                    atexit.register(self.close)
+                directory = self.spill_dir
+            kf.spill(directory)
+
+    def close(self):
+        with self.lock:
+            self.in_memory.clear()
+            self.used = 0
+            spill_dir, self.spill_dir = self.spill_dir, None
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+class PageHistory:
+    def __init__(self, store, base):
+        self.store = store
+        self.ops = [None]  # ops[0] stands for the base image
+
+        if isinstance(base, Image.Image):
+            self.keyframes = {0: store.keyframe(base)}
+        else:
+            self.keyframes = {0: Keyframe(store, source=base)}
+        self.cursor = 0
+        # Bumped whenever ops up to the cursor are replaced, so renders of
+        # earlier positions can be cached by (pos, generation)
+        self.generation = 0
+
+    @profile.timed("history_push")
+    def push(self, op, img=None):
+        # img is the result, if the caller has it; geometry ops are pushed
+        # without one and get no keyframe.
+        # Anything after the cursor was undone and is dropped (no redo)
+        for pos in [p for p in self.keyframes if p > self.cursor]:
+            self.keyframes.pop(pos).discard()
+        if len(self.ops) > self.cursor + 1:
+            self.generation += 1
+        del self.ops[self.cursor + 1:]
+
+        self.ops.append(op)
+        self.cursor += 1
+
+        if img is not None and self.cursor - self.nearest_keyframe(self.cursor) >= KEYFRAME_EVERY:
+            self.keyframes[self.cursor] = self.store.keyframe(img)
+
+    def restore(self, ops):
+        # Ops saved in a project; rendered from the base on first use
+        self.ops = [None] + list(ops)
+        self.cursor = len(ops)
+        self.generation += 1
+
+    def nearest_keyframe(self, pos):
+        # A copy of the positions, push() may add one on another thread
+        return max(p for p in list(self.keyframes) if p <= pos)
+
+    def can_undo(self):
+        return self.cursor > 0
+
+    def can_redo(self):
+        return self.cursor < len(self.ops) - 1
+
+    # Undo and redo only move the cursor; the page renders on demand
+    def undo(self):
+        if not self.can_undo():
+            return False
+        self.cursor -= 1
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self.cursor += 1
+        return True
+
+    @profile.timed("history_render")
+    def render(self, pos=None):
+        pos = self.cursor if pos is None else pos
+        k = self.nearest_keyframe(pos)
+        return core.apply_ops(self.keyframes[k].get(), self.ops[k + 1:pos + 1])
+
+    def discard(self):
+        for kf in self.keyframes.values():
+            kf.discard()
+        self.keyframes.clear()
@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import threading
+
+# Background jobs for the app. Exports and batch adjustments are queued
+# and run one at a time in the order they were submitted, while the user
+# keeps editing. A job function receives its Job, reports progress through
+# job.progress() and should stop once job.cancelled is set. Jobs work on
+# page snapshots (see image_to_pdf_pages.PageSnapshot), never on the live
+# pages, and hand their result back through on_done on the Tk thread.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    ids = itertools.count(1)
+
+    def __init__(self, title, fn, on_done=None):
+        self.id = next(Job.ids)
+        self.title = title
+        self.fn = fn
+        self.on_done = on_done
+        self.state = QUEUED
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.notify = None
+        self.reported = False  # set once the app has handled the outcome
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def progress(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        if self.notify:
+            self.notify(self)
+
+    def describe(self):
+        if self.state == RUNNING and self.total:
+            return f"{self.title}  {self.done}/{self.total}"
+        if self.state == RUNNING and self.cancelled:
+            return f"{self.title}  cancelling"
+        return f"{self.title}  {self.state}"
+
+
+class JobQueue:
+    def __init__(self, notify=None, workers=1):
+        # notify(job) is called from the worker thread on every change
+        self.jobs = []
+        self.notify = notify
+        self.worker = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+
+    def submit(self, title, fn, on_done=None):
+        job = Job(title, fn, on_done)
+        job.notify = self._changed
+        self.jobs.append(job)
+        self._changed(job)
+        self.worker.submit(self._run, job)
+        return job
+
+    def _changed(self, job):
+        if self.notify:
+            self.notify(job)
+
+    def _run(self, job):
+        if job.cancelled:
+            job.state = CANCELLED
+            self._changed(job)
+            return
+
+        job.state = RUNNING
+        self._changed(job)
+        try:
+            job.result = job.fn(job)
+            job.state = CANCELLED if job.cancelled else DONE
+        except Exception as e:
+            job.error = e
+            job.state = FAILED
+        self._changed(job)
+
+    def clear_finished(self):
+        self.jobs = [job for job in self.jobs if not job.finished]
+
+    def close(self):
+        for job in self.jobs:
+            job.cancel()
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_page_range(spec, count):
+    # "1-3, 7, 10-" -> zero-based indices; empty means every page
+    spec = spec.strip()
+    if not spec:
+        return list(range(count))
+
+    indices = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        try:
+            start = int(first) if first.strip() else 1
+            end = (int(last) if last.strip() else count) if sep else start
+        except ValueError:
+            raise ValueError(f"Bad page range {part!r}") from None
+        if not 1 <= start <= end <= count:
+            raise ValueError(f"Page range {part!r} is outside 1-{count}")
+        indices.extend(range(start - 1, end))
+    return indices
@@ -0,0 +1,697 @@
+from PIL import Image
+from collections import OrderedDict
+import hashlib
+import itertools
+import math
+import os
+import threading
+
+import image_to_pdf_core as core
+import image_to_pdf_profile as profile
+from image_to_pdf_store import content_key, default_store
+
+try:
+    import pypdf
+except ImportError:  # PDF input is optional
+    pypdf = None
+
+# Lazy page model. A page keeps only a reference to its source plus cheap
+# header metadata; pixels are decoded on demand and held in a shared LRU
+# cache with a byte budget (ITP_CACHE_MB). Edits go through the page's
+# history, so an evicted edited page can always be rendered again; renders
+# that are more than quarter turns and crops also go to the disk store
+# (image_to_pdf_store), and the next run reads them back.
+
+EXIF_ORIENTATION = 0x0112
+
+# Multi-page inputs: every frame of these formats becomes a page, and so
+# does every page of an image-only PDF (a scan, one image per page). Frames
+# are opened with seek() one at a time, only when that page is needed.
+MULTI_FRAME_FORMATS = ("TIFF", "GIF")
+
+
+# ---------------- Sources ----------------
+class FileSource:
+    # Picklable, so it can be handed to worker processes instead of pixels.
+    # frame is the page within a multi-page file, see file_sources()
+    def __init__(self, path, frame=None):
+        self.path = path
+        self.frame = frame
+
+    def __repr__(self):
+        if self.frame is None:
+            return f"FileSource({self.path!r})"
+        return f"FileSource({self.path!r}, frame={self.frame})"
+
+    def info(self):
+        return read_info(self.path, self.frame, is_pdf(self.path))
+
+    @profile.timed("decode")
+    def load(self, draft=None):
+        return read_image(self.path, self.frame, is_pdf(self.path), draft)
+
+
+class ImageSource:
+    # Pixels that exist only in memory
+    def __init__(self, img):
+        self.img = img
+
+    def info(self):
+        return self.img.size, exif_orientation(self.img)
+
+    def load(self, draft=None):
+        return self.img
+
+
+def exif_orientation(img):
+    try:
+        return img.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return 1
+
+
+def is_pdf(name):
+    return name.lower().endswith(".pdf")
+
+
+def file_sources(path):
+    # One source per page in an input file. Only headers are read: the
+    # frame count of a TIFF or GIF, the page tree of a PDF.
+    if is_pdf(path):
+        count = len(pdf_file(path))
+        return [FileSource(path, i) for i in range(count)]
+
+    with Image.open(path) as f:
+        count = getattr(f, "n_frames", 1) if f.format in MULTI_FRAME_FORMATS else 1
+    if count == 1:
+        return [FileSource(path)]
+    return [FileSource(path, i) for i in range(count)]
+
+
+def read_info(fp, frame=None, pdf=False):
+    # (size, EXIF orientation) of one frame, headers only; fp is a path, a
+    # seekable binary file or for a PDF an open PdfFile
+    if pdf:
+        return pdf_file(fp).page_size(frame or 0), 1
+    with Image.open(fp) as f:
+        if frame:
+            f.seek(frame)
+        return f.size, exif_orientation(f)
+
+
+def read_image(fp, frame=None, pdf=False, draft=None):
+    if pdf:
+        return pdf_page_image(fp, frame or 0)
+    with Image.open(fp) as img:
+        if frame:
+            img.seek(frame)
+        if draft:
+            # JPEG only: decode at a reduced DCT scale, still >= draft
+            img.draft("RGB", draft)
+        return core.page_image(img)
+
+
+# ---------------- PDF input ----------------
+# Parsing the xref and page tree is most of the cost of reading a PDF, so
+# one reader per file is kept and shared by all its pages, with the
+# geometry found for each page. Files on disk are keyed like file_digest, PDFs held
+# in a project by their content digest. Readers dropped from the table are
+# not closed, a page may still be reading; the file closes with its last
+# reference.
+PDF_READERS = 8
+
+_pdf_files = OrderedDict()
+_pdf_files_lock = threading.Lock()
+
+
+def pdf_reader(fh):
+    if pypdf is None:
+        raise ValueError("Reading PDF files needs pypdf")
+    return pypdf.PdfReader(fh)
+
+
+class UnsupportedPdf(ValueError):
+    # A PDF page that is not one image shown upright or in quarter turns
+    pass
+
+
+class PdfFile:
+    # A parsed PDF; pypdf readers are not thread safe, hence the lock
+    def __init__(self, fh):
+        self.reader = pdf_reader(fh)
+        self.geometries = {}  # page index -> geometry of its image, see below
+        self.lock = threading.Lock()
+        profile.count("pdf_opens")
+
+    def __len__(self):
+        with self.lock:
+            return len(self.reader.pages)
+
+    def _geometry(self, index):
+        # Call with the lock held
+        geometry = self.geometries.get(index)
+        if geometry is None:
+            page = self.reader.pages[index]
+            geometry = self.geometries[index] = page_geometry(page, single_image(page, index), index)
+        return geometry
+
+    def page_size(self, index):
+        with self.lock:
+            return core.geometry_size(self._geometry(index))
+
+    def page_image(self, index):
+        with self.lock:
+            geometry = self._geometry(index)
+            img = self.reader.pages[index].images[0].image
+        return core.apply_geometry(core.page_image(img), geometry)
+
+
+def single_image(page, index):
+    # The one image on a page of an image-only PDF. Nothing is rasterised,
+    # a page with anything else on it is rejected.
+    resources = page.get("/Resources")
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    images = [
+        x.get_object() for x in (xobjects.get_object().values() if xobjects else ())
+        if x.get_object().get("/Subtype") == "/Image"
+    ]
+    if len(images) != 1 or len(xobjects.get_object()) != 1:
+        raise UnsupportedPdf(f"PDF page {index + 1} is not a single scanned image")
+    return images[0]
+
+
+# Content stream operators a placed scan may use: save/restore, a matrix,
+# a clip rectangle and the image itself
+PLACEMENT_OPS = {b"q", b"Q", b"cm", b"re", b"W", b"W*", b"n", b"Do"}
+
+
+def page_geometry(page, image, index):
+    # The part of the image the page shows and its quarter turns, as a
+    # core geometry: what the placement matrix, the clip rectangles, the
+    # crop box and /Rotate do, e.g. to a page written by place_image
+    unsupported = UnsupportedPdf(f"PDF page {index + 1} shows its image skewed or mirrored")
+    ctm, stack, clip, rect, placed = (1, 0, 0, 1, 0, 0), [], None, None, None
+    for operands, op in page.get_contents().operations:
+        if op not in PLACEMENT_OPS:
+            raise UnsupportedPdf(f"PDF page {index + 1} is not a single scanned image")
+        if op == b"q":
+            stack.append((ctm, clip))
+        elif op == b"Q" and stack:
+            ctm, clip = stack.pop()
+        elif op == b"cm":
+            ctm = mul_matrix([float(v) for v in operands], ctm)
+        elif op == b"re":
+            x, y, w, h = (float(v) for v in operands)
+            rect = map_rect(ctm, (x, y, x + w, y + h))
+            if rect is None:
+                raise unsupported
+        elif op in (b"W", b"W*") and rect:
+            clip = rect if clip is None else intersect(clip, rect)
+        elif op == b"n":
+            rect = None
+        elif op == b"Do":
+            if placed:
+                raise UnsupportedPdf(f"PDF page {index + 1} is not a single scanned image")
+            placed = ctm, clip
+
+    if placed is None or placed[0][0] * placed[0][3] - placed[0][1] * placed[0][2] <= 0:
+        raise unsupported
+    ctm, clip = placed
+    turns = matrix_turns(ctm)
+    if turns is None:
+        raise unsupported
+
+    # The visible page area, back in image pixels (y down)
+    crop = page.cropbox
+    view = float(crop.left), float(crop.bottom), float(crop.right), float(crop.top)
+    view = intersect(view, clip) if clip else view
+    iw, ih = int(image["/Width"]), int(image["/Height"])
+    a, b, c, d, e, f = ctm
+    det = a * d - b * c
+    xs, ys = [], []
+    for x, y in ((view[0], view[1]), (view[2], view[3])):
+        x, y = x - e, y - f
+        u, v = (d * x - c * y) / det, (a * y - b * x) / det
+        xs.append(min(max(round(u * iw), 0), iw))
+        ys.append(min(max(round((1 - v) * ih), 0), ih))
+    box = (min(xs), min(ys), max(xs), max(ys))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise UnsupportedPdf(f"PDF page {index + 1} shows none of its image")
+
+    # /Rotate turns the page clockwise, core turns are counter-clockwise
+    rotate = int(page.get("/Rotate", 0) or 0)
+    if rotate % 90:
+        raise unsupported
+    return box, (turns - rotate // 90) % 4
+
+
+def mul_matrix(m, n):
+    # m then n, PDF row vector convention
+    a, b, c, d, e, f = m
+    p, q, r, s, t, u = n
+    return (a * p + b * r, a * q + b * s, c * p + d * r, c * q + d * s,
+            e * p + f * r + t, e * q + f * s + u)
+
+
+def matrix_turns(m):
+    # Counter-clockwise quarter turns of an axis-aligned, unmirrored
+    # matrix, or None
+    a, b, c, d = m[:4]
+    eps = 1e-6 * max(abs(a), abs(b), abs(c), abs(d))
+    if abs(b) <= eps and abs(c) <= eps:
+        return 0 if a > 0 else 2
+    if abs(a) <= eps and abs(d) <= eps:
+        return 1 if b > 0 else 3
+    return None
+
+
+def map_rect(m, rect):
+    # An axis-aligned rectangle through m, or None if m skews it
+    if matrix_turns(m) is None:
+        return None
+    a, b, c, d, e, f = m
+    xs = [x * a + y * c + e for x in rect[::2] for y in rect[1::2]]
+    ys = [x * b + y * d + f for x in rect[::2] for y in rect[1::2]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def intersect(r, s):
+    return max(r[0], s[0]), max(r[1], s[1]), min(r[2], s[2]), min(r[3], s[3])
+
+
+def open_pdf(key, opener):
+    # The shared PdfFile for key; opener() returns a seekable binary file
+    # and is only called when the file is not open yet
+    with _pdf_files_lock:
+        pdf = _pdf_files.get(key)
+        if pdf is not None:
+            _pdf_files.move_to_end(key)
+            return pdf
+
+    pdf = PdfFile(opener())  # parsed outside the lock, other files go on
+    with _pdf_files_lock:
+        pdf = _pdf_files.setdefault(key, pdf)
+        _pdf_files.move_to_end(key)
+        while len(_pdf_files) > PDF_READERS:
+            _pdf_files.popitem(last=False)
+    return pdf
+
+
+def pdf_file(fp):
+    # fp is a path, an open PdfFile or a seekable binary file (parsed for
+    # this call only)
+    if isinstance(fp, PdfFile):
+        return fp
+    if isinstance(fp, str):
+        st = os.stat(fp)
+        key = (os.path.abspath(fp), st.st_size, st.st_mtime_ns)
+        return open_pdf(key, lambda: open(fp, "rb"))
+    return PdfFile(fp)
+
+
+def pdf_page_image(fp, index):
+    return pdf_file(fp).page_image(index)
+
+
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    # Remembered while the file is unchanged, the pages of a multi-page
+    # file share one
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _file_digests_lock:
+        digest = _file_digests.get(key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with _file_digests_lock:
+            _file_digests[key] = digest
+    return digest
+
+
+def source_digest(source):
+    # The page's content fingerprint: sha1 of the source bytes, plus the
+    # frame for one page of a multi-page file. The sha1 is kept on the
+    # source (the project writer uses the same attribute); None for pixels
+    # held only in memory
+    digest = getattr(source, "digest", None)
+    if not digest:
+        if hasattr(source, "read_bytes"):
+            digest = hashlib.sha1(source.read_bytes()).hexdigest()
+        elif hasattr(source, "path"):
+            digest = file_digest(source.path)
+        else:
+            return None
+        source.digest = digest
+
+    frame = getattr(source, "frame", None)
+    return digest if frame is None else f"{digest}:{frame}"
+
+
+def pixels_key(source, ops):
+    # Disk store key of source with ops applied; None when the ops are only
+    # cheap geometry or the source exists only in memory
+    if all(core.is_geometry(op) for op in ops):
+        return None
+    digest = source_digest(source)
+    return None if digest is None else content_key("img", digest, ops)
+
+
+# ---------------- Cache ----------------
+class PageCache:
+    def __init__(self, budget_bytes=None):
+        if budget_bytes is None:
+            budget_bytes = int(os.environ.get("ITP_CACHE_MB", "512")) * 1024 * 1024
+
+        self.budget = budget_bytes
+        self.entries = OrderedDict()  # key -> image, least recent first
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+            return img
+
+    def put(self, key, img):
+        nbytes = image_bytes(img)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used -= image_bytes(old)
+            self.entries[key] = img
+            self.used += nbytes
+
+            # The newest entry always stays, even if it alone is over budget
+            while self.used > self.budget and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.used -= image_bytes(evicted)
+
+    def drop(self, key):
+        with self.lock:
+            img = self.entries.pop(key, None)
+            if img is not None:
+                self.used -= image_bytes(img)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+
+def image_bytes(img):
+    return img.width * img.height * len(img.getbands())
+
+
+# ---------------- Page ----------------
+class Page:
+    ids = itertools.count()
+
+    def __init__(self, source, history_store, cache, store=None):
+        self.id = next(Page.ids)
+        self.source = source
+        self.cache = cache
+        self.store = store or default_store()
+        self.version = 0
+        self.lock = threading.Lock()  # one render at a time
+        # Guards version and _size: renders on other threads only keep
+        # their result while the page is still at the version they began
+        self.state_lock = threading.Lock()
+
+        # Header metadata is read on first use, so creating pages is free
+        self._info = None
+        self._size = None  # current size once edited or rendered
+        self.history = history_store.new_page(source)
+
+    @classmethod
+    def from_file(cls, path, history_store, cache):
+        return cls(FileSource(path), history_store, cache)
+
+    @classmethod
+    def from_image(cls, img, history_store, cache):
+        return cls(ImageSource(img), history_store, cache)
+
+    @property
+    def source_size(self):
+        if self._info is None:
+            self._info = self.source.info()
+        return self._info[0]
+
+    @property
+    def orientation(self):
+        if self._info is None:
+            self._info = self.source.info()
+        return self._info[1]
+
+    @property
+    def size(self):
+        if self._size is None and self.edited:
+            size = self._fold_size()
+            return size if size is not None else self.image.size
+        return self._size or self.source_size
+
+    @property
+    def known_size(self):
+        # The current size if it is known without rendering
+        if self._size is None and self.edited:
+            return self._fold_size()
+        return self._size or self.source_size
+
+    def _fold_size(self):
+        version = self.version
+        size = self._folded_size()
+        with self.state_lock:
+            if self.version == version and self._size is None:
+                self._size = size
+        return size
+
+    def _folded_size(self):
+        size = self.source_size
+        for op in self.ops:
+            size = core.op_size(size, op)
+            if size is None:
+                return None
+        return size
+
+    @property
+    def key(self):
+        return (self.id, self.version)
+
+    @property
+    def edited(self):
+        return self.history.cursor > 0
+
+    @property
+    def ops(self):
+        return self.history.ops[1:self.history.cursor + 1]
+
+    @property
+    def image(self):
+        img = self.cache.get(self.key)
+        if img is None:
+            with self.lock:
+                key = self.key
+                img = self.cache.get(key)
+                if img is None:
+                    found = self.geometry()
+                    if found:
+                        pos, geometry = found
+                        base = self.history.render(0) if pos == 0 else self._image_at(pos)
+                        img = core.apply_geometry(base, geometry)
+                    else:
+                        img = self._render()
+                    self._keep(key, img)
+        return img
+
+    def _keep(self, key, img):
+        # Cache a render of version key, unless the page was edited since
+        with self.state_lock:
+            if self.key == key:
+                self.cache.put(key, img)
+                self._size = img.size
+
+    @profile.timed("preview")
+    def preview(self, box):
+        # Screen-sized copy; unedited JPEGs use a reduced-size draft decode
+        key = self.key
+        img = self.cache.get(key)
+        if img is None and not self.edited:
+            img = self.source.load(draft=box)
+            if img.size == self.source_size:
+                # No draft support (not a JPEG), keep the full decode
+                self._keep(key, img)
+        if img is None:
+            found = self.geometry()
+            if found:
+                img = self._geometry_preview(box, *found)
+        if img is None:
+            img = self.image
+        # Bilevel pages are previewed in grey, so they scale smoothly
+        img = img.convert("L") if img.mode == "1" else img.copy()
+        img.thumbnail(box)
+        return img
+
+    def _geometry_preview(self, box, pos, geometry):
+        # The geometry applied to a screen-sized copy of what is under it
+        if pos == 0:
+            size = self.source_size
+            # Draft decode just large enough for the cropped part to fill box
+            w, h = core.geometry_size(geometry)
+            scale = min(box[0] / w, box[1] / h, 1)
+            base = self.source.load(draft=(math.ceil(size[0] * scale), math.ceil(size[1] * scale)))
+        else:
+            base = self._image_at(pos)
+            size = base.size
+        if base.size != size:
+            geometry = core.scale_geometry(geometry, size, base.size)
+        return core.apply_geometry(base, geometry)
+
+    # ---------------- Geometry ----------------
+    def geometry(self):
+        # (pos, geometry) when the ops end in quarter turns and crops, which
+        # fold into a geometry on the image after the first pos ops
+        ops = self.ops
+        pos = core.geometry_start(ops)
+        if pos == len(ops):
+            return None
+        size = self.source_size if pos == 0 else self._image_at(pos).size
+        geometry = core.fold_geometry(size, ops[pos:])
+        return None if geometry is None else (pos, geometry)
+
+    def _at_key(self, pos):
+        return (self.id, "at", pos, self.history.generation)
+
+    def _image_at(self, pos):
+        # The image after the first pos ops, cached while those stay the same
+        key = self._at_key(pos)
+        img = self.cache.get(key)
+        if img is None:
+            img = self._render(pos)
+            self.cache.put(key, img)
+        return img
+
+    def _render(self, pos=None):
+        # Replays the history, unless an earlier run left the result of
+        # these ops on this source in the disk store. This runs on the UI
+        # thread, so a new result is stored in the background.
+        pos = self.history.cursor if pos is None else pos
+        if not self.store.enabled or self.history.nearest_keyframe(pos) == pos:
+            return self.history.render(pos)
+        key = pixels_key(self.source, self.history.ops[1:pos + 1])
+        return self.store.cached_image(key, lambda: self.history.render(pos), later=True)
+
+    def _set(self, img, size=None):
+        # img may be None, then it is rendered on first use
+        with self.state_lock:
+            self.cache.drop(self.key)
+            self.version += 1
+            self._size = img.size if img is not None else size
+            if img is not None:
+                self.cache.put(self.key, img)
+
+    def edit(self, op, img=None, size=None):
+        # img is the result of applying op to the current image. Quarter
+        # turns and crops may leave it out, they only change the geometry;
+        # so may any op whose result is in the disk store, given its size.
+        size = img.size if img is not None else size or core.op_size(self.size, op)
+        if size is None:
+            img = core.apply_op(self.image, op)
+            size = img.size
+
+        current = self.cache.get(self.key) if img is None and core.is_geometry(op) else None
+        self.history.push(op, img)
+        before = self.history.cursor - 1
+        if current is not None and before > 0 and not core.is_geometry(self.history.ops[before]):
+            # The geometry now starts here, keep the image it applies to
+            self.cache.put(self._at_key(before), current)
+        self._set(img, size)
+
+    def restore(self, ops, size=None):
+        # Replay saved ops lazily; size is the edited size if it was saved
+        if ops:
+            self.history.restore(ops)
+            with self.state_lock:
+                self.version += 1
+                self._size = tuple(size) if size else None
+
+    def undo(self):
+        if not self.history.undo():
+            return False
+        self._set(None)
+        return True
+
+    def redo(self):
+        if not self.history.redo():
+            return False
+        self._set(None)
+        return True
+
+    def snapshot(self):
+        return PageSnapshot(self)
+
+    def discard(self):
+        # Snapshots still held by jobs replay from the source from now on
+        with self.state_lock:
+            self.cache.drop(self.key)
+            self.version += 1
+        self.history.discard()
+
+
+class PageSnapshot:
+    # A page frozen at its current version, for background jobs. While the
+    # page is unchanged its cached image is used, after that the saved ops
+    # are replayed from the source, so later edits never leak in.
+    def __init__(self, page):
+        self.page = page
+        self.version = page.version
+        self.source = page.source
+        self.ops = page.ops
+
+    @property
+    def edited(self):
+        return bool(self.ops)
+
+    @property
+    def current(self):
+        return self.page.version == self.version
+
+    @property
+    def source_size(self):
+        return self.page.source_size
+
+    @property
+    def image(self):
+        if self.current:
+            img = self.page.image
+            if self.current:
+                return img
+        store = self.page.store
+        key = pixels_key(self.source, self.ops) if store.enabled else None
+        return store.cached_image(key, lambda: core.apply_ops(self.source.load(), self.ops))
+
+    def task(self):
+        # What to send to a worker pool: the source when untouched, else pixels
+        return self.image if self.edited else self.source
+
+    def load(self, draft=None):
+        # Like a page source, so a thread pool worker can render it
+        return self.image if self.edited else self.source.load(draft)
+
+
+# ---------------- Pool tasks ----------------
+def stored_auto_adjust_task(job, **options):
+    # job is (item, key), item as for core.auto_adjust_task. The worker
+    # also puts the result in the disk store under key, so the thread
+    # collecting results never waits on the write
+    item, key = job
+    img = core.auto_adjust_task(item, **options)
+    default_store().put_image(key, img)
+    return img
@@ -0,0 +1,171 @@
+from collections import defaultdict
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Optional timing instrumentation for the pipeline stages.
+#
+#   ITP_PROFILE=1            per-stage timers and counters, report on exit
+#   ITP_TRACE=trace.json     also record every stage call as a Chrome trace
+#                            (chrome://tracing, Perfetto), all threads
+#   ITP_CPROFILE=out.prof    also run cProfile on the main thread
+#
+# The app can switch timing on and off at run time. While disabled, a timed
+# function costs one flag check and stage() hands back a shared no-op.
+# Work done inside process pool workers is timed there and not reported;
+# the callers time the whole batch instead.
+
+enabled = os.environ.get("ITP_PROFILE", "") not in ("", "0")
+trace_path = os.environ.get("ITP_TRACE") or None
+cprofile_path = os.environ.get("ITP_CPROFILE") or None
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: [0, 0.0, 0.0])  # name -> [calls, total s, max s]
+_counters = defaultdict(int)
+_events = []
+_epoch = time.perf_counter()
+_cprofile = None
+_installed = False
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        elapsed = end - self.start
+        with _lock:
+            s = _stats[self.name]
+            s[0] += 1
+            s[1] += elapsed
+            if elapsed > s[2]:
+                s[2] = elapsed
+            if trace_path:
+                _events.append((self.name, threading.get_ident(), self.start, elapsed))
+        return False
+
+
+class _NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    # with profile.stage("decode"): ...
+    return _Stage(name) if enabled else _NO_STAGE
+
+
+def timed(name):
+    # Decorator form of stage(); keeps the function picklable by name
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _Stage(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] += n
+
+
+# ---------------- Control ----------------
+def enable(on=True):
+    global enabled
+    enabled = on
+    if on:
+        _install()
+
+
+def _start_cprofile():
+    global _cprofile
+    if _cprofile is None and threading.current_thread() is threading.main_thread():
+        import cProfile
+        _cprofile = cProfile.Profile()
+        _cprofile.enable()
+
+
+# ---------------- Reports ----------------
+def snapshot():
+    with _lock:
+        stats = {name: tuple(s) for name, s in _stats.items()}
+        return stats, dict(_counters)
+
+
+def summary(limit=4):
+    # One line for the status bar: the stages with the most time spent
+    stats, _ = snapshot()
+    top = sorted(stats.items(), key=lambda kv: kv[1][1], reverse=True)[:limit]
+    return "  |  ".join(f"{name} {calls}x {total:.2f}s" for name, (calls, total, _) in top)
+
+
+def report():
+    stats, counters = snapshot()
+    lines = [f"{'stage':20} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9}"]
+    for name, (calls, total, worst) in sorted(stats.items(), key=lambda kv: kv[1][1], reverse=True):
+        lines.append(f"{name:20} {calls:>7} {total:>9.3f} {total / calls * 1000:>9.2f} {worst * 1000:>9.2f}")
+    for name, value in sorted(counters.items()):
+        lines.append(f"{name:20} {value:>7}")
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    with _lock:
+        events = list(_events)
+    pid = os.getpid()
+    trace = [
+        {"name": name, "ph": "X", "pid": pid, "tid": tid,
+         "ts": round((start - _epoch) * 1e6), "dur": round(elapsed * 1e6)}
+        for name, tid, start, elapsed in events
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace}, f)
+
+
+def _dump():
+    if _cprofile is not None:
+        _cprofile.disable()
+        _cprofile.dump_stats(cprofile_path)
+    if trace_path and _events:
+        write_trace(trace_path)
+    stats, _ = snapshot()
+    if stats:
+        print(report(), file=sys.stderr)
+
+
+def _install():
+    # Worker processes import this too; only the parent reports
+    global _installed
+    import multiprocessing
+    if _installed or multiprocessing.parent_process() is not None:
+        return
+    _installed = True
+    if cprofile_path:
+        _start_cprofile()
+    atexit.register(_dump)
+
+
+if enabled:
+    _install()
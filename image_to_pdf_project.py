@@ -0,0 +1,349 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+
+from image_to_pdf_pages import file_digest, is_pdf, open_pdf, read_image, read_info, source_digest
+import image_to_pdf_profile as profile
+import image_to_pdf_thumbs as thumbs
+
+# .itp project files.
+#
+# Version 1 (still readable) stored every page as images/{i}.png plus a
+# project.json with the page count.
+#
+# Version 2 stores each page's original source bytes once, under
+# sources/{sha1}{ext}, uncompressed since they are JPEG/PNG already. A
+# manifest lists the pages as a source member plus a JSON operation list
+# (see image_to_pdf_core.apply_op). Saving to the same file again only
+# appends the sources it does not have yet and a new, numbered manifest;
+# the newest manifest wins when opening. Once the entries no manifest
+# needs any more (older manifests, sources of deleted pages, thumbnails of
+# earlier edits) take up COMPACT_FRACTION of the file or number more than
+# COMPACT_ENTRIES, the save writes a fresh, compacted file instead.
+#
+# Opening reads only the newest manifest. Each page entry also records the
+# page's edited size and a small JPEG thumbnail (thumbs/, see
+# image_to_pdf_thumbs), keyed by the source digest and ops, so nothing has
+# to be decoded or replayed to lay pages out. Pixels are decoded lazily,
+# straight from the zip members, through one shared read handle per
+# project file. Pages of a multi-page TIFF, GIF or PDF share the one
+# source member and record their frame; those frames are read by seeking
+# in the member instead of reading all of it.
+
+FORMAT_VERSION = 2
+MANIFEST_DIR = "manifests/"
+THUMB_DIR = "thumbs/"
+
+COMPACT_FRACTION = 0.5
+COMPACT_ENTRIES = 200
+
+_zip_locks = {}
+_zip_handles = {}
+_zip_guard = threading.Lock()
+
+
+def zip_lock(path):
+    # Appending to a project must not race with pages being read from it
+    key = os.path.abspath(path)
+    with _zip_guard:
+        return _zip_locks.setdefault(key, threading.RLock())
+
+
+def open_zip(path):
+    # Shared read handle, so reading a member does not re-parse the
+    # central directory every time. Call with zip_lock(path) held.
+    key = os.path.abspath(path)
+    z = _zip_handles.get(key)
+    if z is None:
+        z = _zip_handles[key] = zipfile.ZipFile(path)
+    return z
+
+
+def close_zip(path):
+    z = _zip_handles.pop(os.path.abspath(path), None)
+    if z is not None:
+        z.close()
+
+
+# ---------------- Sources ----------------
+class ZipSource:
+    # A page source stored inside a project file
+    def __init__(self, zip_path, member, size=None, orientation=None, digest=None, frame=None):
+        self.zip_path = zip_path
+        self.member = member
+        self.size = size
+        self.orientation = orientation
+        self.digest = digest
+        self.frame = frame
+
+    @profile.timed("zip_read")
+    def read_bytes(self):
+        with zip_lock(self.zip_path):
+            data = open_zip(self.zip_path).read(self.member)
+        profile.count("zip_read_bytes", len(data))
+        return data
+
+    def info(self):
+        if self.size is None:
+            if is_pdf(self.member):
+                self.size, self.orientation = read_info(self.pdf(), self.frame, True)
+            else:
+                # Stream just enough of the member to parse the header
+                with zip_lock(self.zip_path):
+                    with open_zip(self.zip_path).open(self.member) as fp:
+                        self.size, self.orientation = read_info(fp, self.frame)
+        return tuple(self.size), self.orientation or 1
+
+    def pdf(self):
+        # pypdf seeks all over the file, member streams only go forward
+        # cheaply; the bytes are read once and shared by the PDF's pages
+        source_digest(self)
+        return open_pdf(self.digest, lambda: io.BytesIO(self.read_bytes()))
+
+    def read_thumb(self, key):
+        # Thumbnail saved with the project, or None
+        return read_member(self.zip_path, f"{THUMB_DIR}{key}.jpg")
+
+    @profile.timed("decode")
+    def load(self, draft=None):
+        if is_pdf(self.member):
+            return read_image(self.pdf(), self.frame, True)
+        if self.frame is None:
+            return read_image(io.BytesIO(self.read_bytes()), draft=draft)
+        # One frame of a multi-page TIFF or GIF, read in place
+        with zip_lock(self.zip_path):
+            with open_zip(self.zip_path).open(self.member) as fp:
+                return read_image(fp, self.frame, draft=draft)
+
+
+def source_entry(source):
+    # (member name, bytes or None) for a page source. Bytes are only
+    # produced when the digest is not known yet.
+    digest = getattr(source, "digest", None)
+
+    if isinstance(source, ZipSource):
+        ext = os.path.splitext(source.member)[1]
+        if digest:
+            return f"sources/{digest}{ext}", None
+        data = source.read_bytes()
+    elif hasattr(source, "path"):
+        # Hashed without keeping the bytes, the pages of a multi-page file
+        # share the digest and the member
+        ext = os.path.splitext(source.path)[1].lower()
+        source.digest = digest or file_digest(source.path)
+        return f"sources/{source.digest}{ext}", None
+    else:
+        # In-memory pixels, stored once as PNG
+        ext = ".png"
+        if digest:
+            return f"sources/{digest}{ext}", None
+        data = source_bytes(source)
+
+    source.digest = hashlib.sha1(data).hexdigest()
+    return f"sources/{source.digest}{ext}", data
+
+
+def source_bytes(source):
+    if isinstance(source, ZipSource):
+        return source.read_bytes()
+    if hasattr(source, "path"):
+        with open(source.path, "rb") as f:
+            return f.read()
+    buf = io.BytesIO()
+    source.load().save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# ---------------- Save ----------------
+def snapshot(pages, current_index):
+    # Taken on the UI thread: sources and op lists are immutable from here.
+    # Nothing is read, headers are left to the save worker.
+    return {
+        "current_index": current_index,
+        "pages": [
+            {
+                "page": page,
+                "version": page.version,
+                "source": page.source,
+                "ops": page.ops,
+            }
+            for page in pages
+        ],
+    }
+
+
+def render_thumb(entry, key):
+    # JPEG bytes for the page thumbnail, or None if the page changed since
+    # the snapshot was taken
+    page = entry["page"]
+    if page.version != entry["version"]:
+        return None
+    data = thumbs.thumb_bytes(page, key)
+    if page.version != entry["version"]:
+        return None
+    return data
+
+
+def project_version(path):
+    try:
+        with zipfile.ZipFile(path) as z:
+            names = z.namelist()
+    except (OSError, zipfile.BadZipFile):
+        return None
+    if any(n.startswith(MANIFEST_DIR) for n in names):
+        return FORMAT_VERSION
+    return 1 if "project.json" in names else None
+
+
+def live_members(snap):
+    # Members the snapshot's manifest will refer to, besides itself
+    live = set()
+    for entry in snap["pages"]:
+        source = entry["source"]
+        live.add(source_entry(source)[0])
+        live.add(f"{THUMB_DIR}{thumbs.thumb_key(source_digest(source), entry['ops'])}.jpg")
+    return live
+
+
+def needs_compacting(path, snap):
+    with zip_lock(path):
+        infos = open_zip(path).infolist()
+    live = live_members(snap)
+    dead = [info for info in infos if info.filename not in live]
+    total = sum(info.compress_size for info in infos) or 1
+    return (sum(info.compress_size for info in dead) > COMPACT_FRACTION * total
+            or len(dead) > COMPACT_ENTRIES)
+
+
+@profile.timed("project_save")
+def save(path, snap):
+    # Append to an existing v2 project, otherwise write a fresh file next
+    # to it and swap it in. A fresh file is also written when the existing
+    # one is mostly entries that are no longer needed.
+    append = project_version(path) == FORMAT_VERSION
+    old = None
+    if append and needs_compacting(path, snap):
+        append = False
+        old = path  # sources and thumbnails are copied from here
+        profile.count("project_compactions")
+    target = path if append else path + ".part"
+    moved = []
+
+    with zip_lock(path):
+        with zipfile.ZipFile(target, "a" if append else "w") as z:
+            existing = set(z.namelist())
+            seq = 1 + sum(1 for n in existing if n.startswith(MANIFEST_DIR))
+
+            pages = []
+            for entry in snap["pages"]:
+                source = entry["source"]
+                member, data = source_entry(source)
+                if member not in existing:
+                    if data is None:
+                        # Digest known but the member is missing (new file)
+                        data = source_bytes(source)
+                    z.writestr(member, data, compress_type=zipfile.ZIP_STORED)
+                    existing.add(member)
+                if isinstance(source, ZipSource) and source.zip_path == path:
+                    moved.append((source, member))
+
+                page = entry["page"]
+                record = {
+                    "source": member,
+                    "size": list(page.source_size),
+                    "orientation": page.orientation,
+                    "ops": entry["ops"],
+                }
+                # Only while the page still has the snapshot's ops
+                page_size = page.known_size
+                if page_size and page.version == entry["version"]:
+                    record["page_size"] = list(page_size)
+                if getattr(source, "frame", None) is not None:
+                    record["frame"] = source.frame
+
+                key = thumbs.thumb_key(source_digest(source), entry["ops"])
+                thumb = f"{THUMB_DIR}{key}.jpg"
+                if thumb not in existing:
+                    data = old and read_member(old, thumb)
+                    data = data or render_thumb(entry, key)
+                    if data:
+                        z.writestr(thumb, data, compress_type=zipfile.ZIP_STORED)
+                        existing.add(thumb)
+                if thumb in existing:
+                    record["thumb"] = thumb
+
+                pages.append(record)
+
+            manifest = {
+                "version": FORMAT_VERSION,
+                "current_index": snap["current_index"],
+                "pages": pages,
+            }
+            z.writestr(
+                f"{MANIFEST_DIR}{seq:06d}.json", json.dumps(manifest),
+                compress_type=zipfile.ZIP_DEFLATED
+            )
+
+        # Readers reopen the file to see the new entries
+        close_zip(path)
+
+        if not append:
+            os.replace(target, path)
+            # Pages read from the old file now live under new member names
+            for source, member in moved:
+                source.member = member
+
+
+def read_member(path, name):
+    # Bytes of a member of the project at path, or None
+    with zip_lock(path):
+        try:
+            return open_zip(path).read(name)
+        except KeyError:
+            return None
+
+
+# ---------------- Open ----------------
+class ProjectPage:
+    # One page entry of an opened project, nothing decoded yet
+    def __init__(self, source, ops=(), page_size=None, thumb=None):
+        self.source = source
+        self.ops = list(ops)
+        self.page_size = page_size
+        self.thumb = thumb
+
+
+@profile.timed("project_open")
+def load(path):
+    # Returns (current_index, [ProjectPage, ...]); only the manifest is
+    # read, for version 1 files just project.json
+    close_zip(path)
+
+    with zip_lock(path):
+        z = open_zip(path)
+        manifests = sorted(n for n in z.namelist() if n.startswith(MANIFEST_DIR))
+
+        if manifests:
+            manifest = json.loads(z.read(manifests[-1]))
+            pages = []
+            for entry in manifest["pages"]:
+                member = entry["source"]
+                digest = os.path.splitext(os.path.basename(member))[0]
+                source = ZipSource(path, member, entry.get("size"),
+                                   entry.get("orientation"), digest, entry.get("frame"))
+                pages.append(ProjectPage(
+                    source, entry.get("ops", []),
+                    entry.get("page_size"), entry.get("thumb")
+                ))
+            return manifest.get("current_index", 0), pages
+
+        # Version 1: flattened PNG per page, also read lazily
+        project_data = json.loads(z.read("project.json"))
+        pages = [
+            ProjectPage(ZipSource(path, f"images/{i}.png"))
+            for i in range(project_data["image_count"])
+        ]
+        return project_data.get("current_index", 0), pages
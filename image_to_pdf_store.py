@@ -0,0 +1,240 @@
+from PIL import Image
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import image_to_pdf_profile as profile
+
+# Persistent cache of processed pages, shared across runs and processes.
+#
+# Entries are content addressed: the key is a sha1 of the source's content
+# digest (image_to_pdf_pages.source_digest), the page's op list in
+# canonical JSON and whatever else changes the result, such as the export
+# options. Two kinds are kept, processed pixels ("img") and encoded PDF
+# image streams ("pdf"), so a repeat run only pays for the pages that
+# changed. Files live under ITP_STORE_DIR (by default
+# ~/.cache/image-to-pdf/pages) and take at most ITP_STORE_MB (default
+# 2048, 0 turns the store off). A hit touches the file; once the directory
+# grows past the cap the least recently used files are removed.
+#
+# Entries are written to a temporary file and renamed, so readers never
+# see half an entry, and any number of threads and processes may share the
+# directory. A reader that loses a race with eviction just misses. Renders
+# for the UI are written by a background thread, and the eviction scan
+# always runs in one, so neither holds up the caller.
+
+# Part of every key; bump it when the pipeline's output for the same ops
+# changes, so entries from older versions are never used
+VERSION = 3
+
+LOW_WATER = 0.9  # eviction frees space down to this fraction of the cap
+STALE_PART = 3600  # seconds after which a leftover temporary file is removed
+WRITE_QUEUE = 4  # images waiting for the background writer; more are not stored
+
+
+def content_key(kind, digest, ops, **params):
+    data = json.dumps([VERSION, kind, digest, ops, params], sort_keys=True)
+    return kind + "-" + hashlib.sha1(data.encode()).hexdigest()
+
+
+def pack(header, payload):
+    return json.dumps(header).encode() + b"\n" + payload
+
+
+def unpack(data):
+    head, _, payload = data.partition(b"\n")
+    return json.loads(head), payload
+
+
+# ---------------- Store ----------------
+class PageStore:
+    counters = "store"  # prefix of the profile counters
+
+    def __init__(self, directory=None, budget_bytes=None):
+        if directory is None:
+            directory = os.environ.get("ITP_STORE_DIR") or os.path.join(
+                os.path.expanduser("~"), ".cache", "image-to-pdf", "pages"
+            )
+        if budget_bytes is None:
+            budget_bytes = int(os.environ.get("ITP_STORE_MB", "2048")) * 1024 * 1024
+
+        self.directory = directory
+        self.budget = budget_bytes
+        self.used = None  # bytes on disk as of the last scan, None before it
+        self.unscanned = 0  # bytes written by this process since
+        self.lock = threading.Lock()
+        self.evicting = threading.Lock()
+        self.pending = None  # (key, image) queue of the background writer
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[-2:], key)
+
+    def get(self, key):
+        if not self.enabled or key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            profile.count(f"{self.counters}_misses")
+            return None
+        try:
+            os.utime(path)  # recently used
+        except OSError:
+            pass
+        profile.count(f"{self.counters}_hits")
+        return data
+
+    def put(self, key, data):
+        if not self.enabled or key is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return  # the store is only an optimisation
+
+        with self.lock:
+            self.unscanned += len(data)
+            due = (self.used is None or self.used + self.unscanned > self.budget
+                   or self.unscanned > self.budget // 8)
+        if due and not self.evicting.locked():
+            threading.Thread(target=self.evict, daemon=True).start()
+
+    @profile.timed("store_evict")
+    def evict(self):
+        # Other processes write too, so the total comes from a scan of the
+        # directory; one thread per process does it, the others carry on
+        if not self.evicting.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            entries = []
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if name.endswith(".part"):
+                        if now - st.st_mtime > STALE_PART:
+                            _remove(path)  # left by a writer that died
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            if total > self.budget:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.budget * LOW_WATER:
+                        break
+                    if _remove(path):
+                        total -= size
+                        profile.count(f"{self.counters}_evictions")
+            with self.lock:
+                self.used = total
+                self.unscanned = 0
+        finally:
+            self.evicting.release()
+
+    # ---------------- Pixels ----------------
+    def cached_image(self, key, render, later=False):
+        # render() unless the store already has the result; with later it
+        # is written in the background, for callers that must not wait
+        img = self.get_image(key)
+        if img is None:
+            img = render()
+            if later:
+                self.put_image_later(key, img)
+            else:
+                self.put_image(key, img)
+        return img
+
+    def image_size(self, key):
+        # Size of a stored image, read from its header; None when not stored
+        if not self.enabled or key is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+            os.utime(path)
+            return tuple(header["size"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get_image(self, key):
+        data = self.get(key)
+        if data is None:
+            return None
+        try:
+            header, payload = unpack(data)
+            return Image.frombytes(header["mode"], tuple(header["size"]), zlib.decompress(payload))
+        except Exception:
+            _remove(self._path(key))  # unreadable, computed again
+            return None
+
+    @profile.timed("store_put_image")
+    def put_image(self, key, img):
+        # Raw pixels with fast zlib: much quicker to write and read than PNG
+        if not self.enabled or key is None:
+            return
+        header = {"mode": img.mode, "size": list(img.size)}
+        self.put(key, pack(header, zlib.compress(img.tobytes(), 1)))
+
+    def put_image_later(self, key, img):
+        if not self.enabled or key is None:
+            return
+        with self.lock:
+            if self.pending is None:
+                self.pending = queue.Queue(WRITE_QUEUE)
+                threading.Thread(target=self._write_pending, daemon=True).start()
+        try:
+            self.pending.put_nowait((key, img))
+        except queue.Full:
+            profile.count("store_writes_dropped")  # rendered again next time
+
+    def _write_pending(self):
+        while True:
+            key, img = self.pending.get()
+            try:
+                self.put_image(key, img)
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        # Wait for the background writes queued so far
+        if self.pending is not None:
+            self.pending.join()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = PageStore()
+    return _default_store
@@ -0,0 +1,152 @@
+from PIL import Image
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import os
+import threading
+
+import image_to_pdf_profile as profile
+from image_to_pdf_pages import source_digest
+from image_to_pdf_store import PageStore
+
+# Page thumbnails for the filmstrip.
+#
+# A thumbnail is keyed by page content: the sha1 of the source bytes plus
+# the page's operation list. Rendered thumbnails are stored as small JPEGs
+# in a local cache directory (ITP_THUMB_DIR, by default
+# ~/.cache/image-to-pdf/thumbs) and inside .itp projects, so reloading the
+# same files or reopening a project does not decode any pages. Pages that
+# exist only in memory have no stable key and are cached in memory only.
+# The directory is capped like the page store, at ITP_THUMB_MB (default
+# 256), least recently used thumbnails first.
+
+THUMB_SIZE = (160, 160)
+
+
+def thumb_key(digest, ops):
+    data = digest + json.dumps(ops, sort_keys=True)
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def page_key(page):
+    digest = source_digest(page.source)
+    if digest is None:
+        return None
+    return thumb_key(digest, page.ops)
+
+
+def encode_thumb(img):
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=80)
+    return buf.getvalue()
+
+
+def decode_thumb(data):
+    with Image.open(io.BytesIO(data)) as img:
+        return img.convert("RGB")
+
+
+# ---------------- Disk cache ----------------
+class ThumbStore(PageStore):
+    # A PageStore with its own directory, budget and file names
+    counters = "thumb_store"
+
+    def __init__(self, directory=None, budget_bytes=None):
+        if directory is None:
+            directory = os.environ.get("ITP_THUMB_DIR") or os.path.join(
+                os.path.expanduser("~"), ".cache", "image-to-pdf", "thumbs"
+            )
+        if budget_bytes is None:
+            budget_bytes = int(os.environ.get("ITP_THUMB_MB", "256")) * 1024 * 1024
+        super().__init__(directory, budget_bytes)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".jpg")
+
+
+_default_store = None
+
+
+def default_store():
+    global _default_store
+    if _default_store is None:
+        _default_store = ThumbStore()
+    return _default_store
+
+
+@profile.timed("thumbnail")
+def thumb_bytes(page, key=None, store=None):
+    # JPEG bytes of a page thumbnail: from the project the page came from,
+    # the local cache, or rendered from the page (and then cached)
+    store = store or default_store()
+    version = page.version
+    key = key or page_key(page)
+
+    if key:
+        read_thumb = getattr(page.source, "read_thumb", None)
+        data = (read_thumb and read_thumb(key)) or store.get(key)
+        if data:
+            return data
+
+    data = encode_thumb(page.preview(THUMB_SIZE))
+    if key and page.version == version:
+        store.put(key, data)
+    return data
+
+
+# ---------------- Memory cache ----------------
+class ThumbnailCache:
+    # Decoded thumbnails by (page id, version), rendered on background
+    # threads. Requests from an earlier begin() that have not started yet
+    # are skipped, so scrolling quickly past pages costs nothing.
+    def __init__(self, store=None, capacity=400, workers=2):
+        self.store = store or default_store()
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.worker = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbs")
+
+    def peek(self, page):
+        with self.lock:
+            img = self.entries.get(page.key)
+            if img is not None:
+                self.entries.move_to_end(page.key)
+            return img
+
+    def begin(self):
+        with self.lock:
+            self.generation += 1
+            self.pending.clear()
+
+    def request(self, page, callback):
+        # callback(page) runs on a worker thread once the thumbnail is in
+        key = page.key
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+            generation = self.generation
+        self.worker.submit(self._load, page, key, generation, callback)
+
+    def _load(self, page, key, generation, callback):
+        if generation != self.generation or page.key != key:
+            return
+
+        try:
+            img = decode_thumb(thumb_bytes(page, store=self.store))
+        except Exception:
+            return  # unreadable page, the filmstrip keeps its placeholder
+
+        with self.lock:
+            self.pending.discard(key)
+            self.entries[key] = img
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        callback(page)
+
+    def close(self):
+        self.worker.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,256 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+import image_to_pdf_cli as cli
+import image_to_pdf_core as core
+import image_to_pdf_document as documents
+import image_to_pdf_export as export
+
+# Watch-folder service: turns image sets arriving in one or more
+# directories into PDFs, continuously and without the GUI.
+#
+#   python image_to_pdf_watch.py --output pdfs/ scans/ fax/
+#
+# Inside a watched directory, every subfolder of images is one document
+# (written to OUTPUT/<subfolder>.pdf), and every *.json file is a manifest
+# in the CLI jobs format, {"output": "x.pdf", "inputs": ["dir", "*.png"]},
+# with paths relative to the manifest. A document is picked up once its
+# files have not changed for --settle seconds.
+#
+# Documents share one worker pool, and at most --max-pending are converted
+# at a time; new arrivals wait until one finishes. Finished documents are
+# recorded with a fingerprint of their inputs in a checkpoint file, so a
+# restart skips them unless their files changed since.
+#
+# The output directory and the checkpoint file are never read as input,
+# even when they sit inside a watched directory: PDFs are inputs too.
+
+
+class Document:
+    def __init__(self, key, output, inputs, skip=()):
+        self.key = key
+        self.output = output
+        self.inputs = inputs
+        self.files = [f for f in core.expand_inputs(inputs) if not excluded(f, skip)]
+
+    def fingerprint(self, extra=b""):
+        h = hashlib.sha1(extra)
+        for path in self.files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            h.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+        return h.hexdigest()
+
+
+def excluded(path, skip):
+    # path is, or is inside, one of the real paths in skip
+    real = os.path.realpath(path)
+    return any(real == s or real.startswith(s + os.sep) for s in skip)
+
+
+def discover(directory, output_dir, skip=()):
+    # (Document, fingerprint) for each image set in directory; skip holds
+    # real paths that are never input (the output directory, checkpoint)
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return
+
+    for name in names:
+        path = os.path.join(directory, name)
+        if excluded(path, skip):
+            continue
+        if os.path.isdir(path):
+            doc = Document(os.path.abspath(path), os.path.join(output_dir, name + ".pdf"), [path], skip)
+            if doc.files:
+                yield doc, doc.fingerprint()
+        elif name.lower().endswith(".json"):
+            try:
+                with open(path, "rb") as f:
+                    raw = f.read()
+                manifest = json.loads(raw)
+                inputs = [os.path.join(directory, p) for p in manifest["inputs"]]
+                output = os.path.join(output_dir, manifest["output"])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue  # still being written, or not a manifest
+            doc = Document(os.path.abspath(path), output, inputs, skip)
+            if doc.files:
+                yield doc, doc.fingerprint(raw)
+
+
+# ---------------- Checkpoint ----------------
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.documents = json.load(f).get("documents", {})
+        except (OSError, ValueError):
+            self.documents = {}
+
+    def finished(self, key, fingerprint):
+        entry = self.documents.get(key)
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    def record(self, key, fingerprint, **info):
+        # Failed documents are recorded too, they are retried once changed
+        with self.lock:
+            self.documents[key] = dict(info, fingerprint=fingerprint, time=time.time())
+            tmp = self.path + ".part"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"documents": self.documents}, f, indent=1)
+            os.replace(tmp, self.path)
+
+
+# ---------------- Watcher ----------------
+class Watcher:
+    def __init__(self, directories, output_dir, options, pool, checkpoint,
+                 settle=5.0, max_pending=2, auto_adjust=True, auto_options=None, log=print):
+        self.directories = directories
+        self.output_dir = output_dir
+        self.options = options
+        self.pool = pool
+        self.checkpoint = checkpoint
+        self.settle = settle
+        self.max_pending = max_pending
+        self.auto_adjust = auto_adjust
+        self.auto_options = auto_options or {}
+        self.log = log
+
+        self.skip = {os.path.realpath(output_dir), os.path.realpath(checkpoint.path)}
+        self.seen = {}  # key -> (fingerprint, unchanged since)
+        self.in_flight = {}  # key -> future
+        self.runner = ThreadPoolExecutor(max_workers=max_pending, thread_name_prefix="watch")
+
+    def ready(self):
+        # Documents whose files have settled and that are not done yet
+        now = time.monotonic()
+        found = []
+        present = set()
+        for directory in self.directories:
+            for doc, fp in discover(directory, self.output_dir, self.skip):
+                present.add(doc.key)
+                last = self.seen.get(doc.key)
+                if last is None or last[0] != fp:
+                    self.seen[doc.key] = (fp, now)
+                    if self.settle > 0:
+                        continue
+                elif now - last[1] < self.settle:
+                    continue
+                if doc.key in self.in_flight or self.checkpoint.finished(doc.key, fp):
+                    continue
+                found.append((doc, fp))
+
+        # Forget documents that were removed before they settled
+        for key in [k for k in self.seen if k not in present]:
+            del self.seen[key]
+        return found
+
+    def convert(self, doc, fp):
+        t0 = time.perf_counter()
+        job = {"output": doc.output, "inputs": doc.inputs}
+        try:
+            count = cli.run_job(job, self.pool, self.options, self.auto_adjust, **self.auto_options)
+        except Exception as e:
+            self.checkpoint.record(doc.key, fp, output=doc.output, status="failed", error=str(e))
+            self.log(f"FAIL {doc.output}: {e}")
+            return
+        self.checkpoint.record(doc.key, fp, output=doc.output, status="done", pages=count)
+        self.log(f"ok   {doc.output}  {count} pages  {time.perf_counter() - t0:.3f}s")
+
+    def step(self):
+        # One scan; returns True while anything is converting or waiting
+        for key in [k for k, f in self.in_flight.items() if f.done()]:
+            del self.in_flight[key]
+
+        waiting = False
+        for doc, fp in self.ready():
+            if len(self.in_flight) >= self.max_pending:
+                waiting = True  # back-pressure, picked up on a later scan
+                break
+            self.in_flight[doc.key] = self.runner.submit(self.convert, doc, fp)
+
+        settling = any(
+            not self.checkpoint.finished(key, fp) and key not in self.in_flight
+            for key, (fp, _) in self.seen.items()
+        )
+        return bool(self.in_flight) or waiting or settling
+
+    def run(self, interval=2.0, once=False, stop=None):
+        stop = stop or threading.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        try:
+            while not stop.is_set():
+                busy = self.step()
+                if once and not busy:
+                    break
+                stop.wait(interval)
+        finally:
+            # Documents already converting are finished and checkpointed
+            self.runner.shutdown(wait=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert image sets arriving in folders into PDFs")
+    parser.add_argument("directories", nargs="+", metavar="DIR", help="folders to watch")
+    parser.add_argument("--output", required=True, metavar="DIR", help="where PDFs are written")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help="progress file (default: OUTPUT/.itp-watch.json)")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between scans")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="seconds a document's files must stay unchanged")
+    parser.add_argument("--max-pending", type=int, default=2,
+                        help="documents converted at the same time")
+    parser.add_argument("--once", action="store_true",
+                        help="convert what is there, then exit")
+    parser.add_argument("--no-auto-adjust", action="store_true", help="skip auto rotate/enhance")
+    parser.add_argument("--document", action="store_true",
+                        help="also find the page in photos, crop and deskew it (needs NumPy)")
+    parser.add_argument("--adaptive", action="store_true", help="adaptive auto enhance")
+    parser.add_argument("--scan", choices=core.SCAN_MODES, default=None,
+                        help="convert pages to grayscale or black and white")
+    parser.add_argument("--encoding", choices=export.ENCODINGS, default="auto")
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--dpi", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument("--threads", action="store_true",
+                        help="use a thread pool instead of processes")
+    args = parser.parse_args(argv)
+    if args.document and not documents.available():
+        parser.error("--document needs NumPy")
+
+    os.makedirs(args.output, exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(args.output, ".itp-watch.json"))
+    options = export.ExportOptions(args.encoding, args.quality, args.dpi)
+    auto_options = {
+        k: v for k, v in (("document", args.document), ("adaptive", args.adaptive), ("scan", args.scan))
+        if v
+    }
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    with core.make_pool(args.workers, processes=not args.threads) as pool:
+        watcher = Watcher(
+            args.directories, args.output, options, pool, checkpoint,
+            settle=args.settle, max_pending=args.max_pending,
+            auto_adjust=not args.no_auto_adjust, auto_options=auto_options
+        )
+        watcher.run(args.interval, once=args.once, stop=stop)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
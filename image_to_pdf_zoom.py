@@ -0,0 +1,258 @@
+from PIL import Image, ImageTk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+
+import image_to_pdf_profile as profile
+
+# Zoom and pan for the page canvas.
+#
+# At fit zoom the canvas shows the screen-sized preview from the
+# DisplayCache, as before. Zoomed in, it draws from a tile pyramid of the
+# page: level 0 is the page at full resolution, every further level half
+# the size of the one before. Pyramids are built in the background when a
+# page is first zoomed, and the last few are kept. Only the tiles in view
+# are cut from the smallest level that still has a pixel per screen pixel,
+# scaled and turned into PhotoImages; panning reuses the tiles already
+# made. Until the pyramid is ready the preview stands in, enlarged.
+
+TILE = 256
+MIN_LEVEL = 256  # the pyramid ends with a level that fits in this
+MAX_ZOOM = 8.0  # screen pixels per image pixel
+ZOOM_STEP = 1.25
+
+
+class Pyramid:
+    def __init__(self, key, levels):
+        self.key = key
+        self.levels = levels
+
+    def level_for(self, scale):
+        # Smallest level with at least one pixel per screen pixel
+        level = int(math.floor(math.log2(1 / scale))) if scale < 1 else 0
+        return min(level, len(self.levels) - 1)
+
+
+def build_levels(img):
+    # Bilevel pages are shown in grey, like their previews
+    levels = [img.convert("L") if img.mode == "1" else img]
+    while max(levels[-1].size) > MIN_LEVEL:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+class PyramidCache:
+    def __init__(self, keep=2):
+        self.keep = keep
+        self.entries = OrderedDict()  # page id -> Pyramid, least recent first
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyramid")
+
+    def get(self, page):
+        with self.lock:
+            pyramid = self.entries.get(page.id)
+            if pyramid is not None and pyramid.key == page.key:
+                self.entries.move_to_end(page.id)
+                return pyramid
+        return None
+
+    def request(self, page, callback):
+        # Build in the background; callback() runs on the worker thread
+        key = page.key
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        self.worker.submit(self._build, page, key, callback)
+
+    @profile.timed("pyramid")
+    def _build(self, page, key, callback):
+        try:
+            if page.key != key:
+                return  # edited meanwhile, the next draw asks again
+            pyramid = Pyramid(key, build_levels(page.image))
+            if page.key != key:
+                return
+            with self.lock:
+                self.entries[page.id] = pyramid
+                self.entries.move_to_end(page.id)
+                while len(self.entries) > self.keep:
+                    self.entries.popitem(last=False)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+        callback()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def close(self):
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+
+class ZoomView:
+    # Draws a page on the canvas, fitted or zoomed, and maps between canvas
+    # and image coordinates for whatever is shown
+    def __init__(self, canvas, pyramids, on_ready):
+        # on_ready() is called from the worker thread once a pyramid is built
+        self.canvas = canvas
+        self.pyramids = pyramids
+        self.on_ready = on_ready
+        self.page = None
+        self.size = None
+        self.zoom = None  # canvas pixels per image pixel, None while fitted
+        self.fit_scale = 1.0
+        self.offset = (0, 0)  # canvas position of the image origin
+        self.scale = 1.0  # as drawn
+        self.photos = {}  # (level, tx, ty) -> PhotoImage of the tiles drawn
+        self.photo_scale = None
+        self.backdrop = None
+
+    @property
+    def zoomed(self):
+        return self.zoom is not None
+
+    def to_image(self, x, y):
+        return (x - self.offset[0]) / self.scale, (y - self.offset[1]) / self.scale
+
+    def to_canvas(self, ix, iy):
+        return self.offset[0] + ix * self.scale, self.offset[1] + iy * self.scale
+
+    def reset(self):
+        self.page = None
+        self.zoom = None
+        self.photos = {}
+        self.backdrop = None
+
+    # ---------------- Draw ----------------
+    def draw(self, page, preview, photo, fit=False):
+        # preview/photo: the page fitted to the canvas (DisplayCache or the
+        # slider proxy); fit draws just that, keeping the zoom for later
+        size = page.size
+        if page is not self.page or size != self.size:
+            # Another page, or the same one cropped or turned
+            self.page, self.size = page, size
+            self.zoom = None
+            self.photos = {}
+
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        self.fit_scale = preview.width / size[0]
+        if self.zoom is not None and self.zoom <= self.fit_scale:
+            self.zoom = None  # the canvas grew past the zoom
+
+        if fit or self.zoom is None:
+            x = (cw - preview.width) // 2
+            y = (ch - preview.height) // 2
+            self.offset, self.scale = (x, y), self.fit_scale
+            self.canvas.create_image(x, y, image=photo, anchor="nw")
+            return
+
+        self.scale = self.zoom
+        self._clamp((cw, ch))
+        pyramid = self.pyramids.get(page)
+        if pyramid is None:
+            self.pyramids.request(page, self.on_ready)
+            self._draw_backdrop(preview, (cw, ch))
+        else:
+            self._draw_tiles(pyramid, (cw, ch))
+
+    def _visible(self, canvas_size):
+        # Part of the image in view, in image pixels
+        x0, y0 = self.to_image(0, 0)
+        x1, y1 = self.to_image(*canvas_size)
+        return max(x0, 0), max(y0, 0), min(x1, self.size[0]), min(y1, self.size[1])
+
+    def _draw_backdrop(self, preview, canvas_size):
+        # The preview, cut to the view and enlarged, while tiles are built
+        x0, y0, x1, y1 = self._visible(canvas_size)
+        s = self.fit_scale
+        box = (int(x0 * s), int(y0 * s), max(math.ceil(x1 * s), int(x0 * s) + 1),
+               max(math.ceil(y1 * s), int(y0 * s) + 1))
+        cx0, cy0 = self.to_canvas(box[0] / s, box[1] / s)
+        cx1, cy1 = self.to_canvas(box[2] / s, box[3] / s)
+        img = preview.crop(box).resize((max(round(cx1 - cx0), 1), max(round(cy1 - cy0), 1)))
+        self.backdrop = ImageTk.PhotoImage(img)
+        self.canvas.create_image(round(cx0), round(cy0), image=self.backdrop, anchor="nw")
+
+    @profile.timed("tiles")
+    def _draw_tiles(self, pyramid, canvas_size):
+        level = pyramid.level_for(self.scale)
+        src = pyramid.levels[level]
+        lsx, lsy = src.width / self.size[0], src.height / self.size[1]
+        if self.photo_scale != (pyramid.key, level, self.scale):
+            self.photo_scale = (pyramid.key, level, self.scale)
+            self.photos = {}
+
+        # Smaller source tiles when magnifying, so a tile stays screen-sized
+        ts = max(TILE // max(int(self.scale / lsx), 1), 16)
+        x0, y0, x1, y1 = self._visible(canvas_size)
+        tx0, ty0 = int(x0 * lsx) // ts, int(y0 * lsy) // ts
+        tx1 = min(math.ceil(x1 * lsx / ts), math.ceil(src.width / ts))
+        ty1 = min(math.ceil(y1 * lsy / ts), math.ceil(src.height / ts))
+        resample = Image.Resampling.NEAREST if self.scale >= 2 else Image.Resampling.BILINEAR
+
+        drawn = {}
+        for ty in range(ty0, ty1):
+            for tx in range(tx0, tx1):
+                # Edges are placed independently of the pan, so neighbours
+                # always meet and a tile keeps its size while panning
+                left, top = tx * ts, ty * ts
+                right, bottom = min(left + ts, src.width), min(top + ts, src.height)
+                px0, py0 = round(left / lsx * self.scale), round(top / lsy * self.scale)
+                px1, py1 = round(right / lsx * self.scale), round(bottom / lsy * self.scale)
+
+                photo = self.photos.get((level, tx, ty))
+                if photo is None:
+                    tile = src.crop((left, top, right, bottom))
+                    tile = tile.resize((max(px1 - px0, 1), max(py1 - py0, 1)), resample)
+                    photo = ImageTk.PhotoImage(tile)
+                    profile.count("tiles_made")
+                drawn[(level, tx, ty)] = photo
+                self.canvas.create_image(self.offset[0] + px0, self.offset[1] + py0,
+                                         image=photo, anchor="nw")
+        self.photos = drawn
+
+    def _clamp(self, canvas_size):
+        # Keep the page on screen; centred along an axis where it fits.
+        # Whole-pixel offsets, so tiles line up.
+        offset = []
+        for o, extent, view in zip(self.offset, self.size, canvas_size):
+            shown = extent * self.scale
+            if shown <= view:
+                offset.append(round((view - shown) / 2))
+            else:
+                offset.append(round(min(0, max(view - shown, o))))
+        self.offset = tuple(offset)
+
+    # ---------------- Navigate ----------------
+    def zoom_at(self, factor, x, y):
+        # Zoom by factor keeping the image point under (x, y) in place;
+        # returns False when nothing changed
+        if self.page is None:
+            return False
+        scale = min(max(self.scale * factor, self.fit_scale), MAX_ZOOM)
+        if scale == self.scale:
+            return False
+        ix, iy = self.to_image(x, y)
+        self.offset = (x - ix * scale, y - iy * scale)
+        self.scale = scale
+        self.zoom = scale if scale > self.fit_scale * 1.001 else None
+        return True
+
+    def actual_size(self, x, y):
+        # One image pixel per screen pixel, around (x, y)
+        return self.zoom_at(1.0 / self.scale, x, y)
+
+    def fit(self):
+        changed = self.zoom is not None
+        self.zoom = None
+        return changed
+
+    def pan(self, dx, dy):
+        if self.zoom is None:
+            return False
+        self.offset = (self.offset[0] + dx, self.offset[1] + dy)
+        return True
@@ -0,0 +1,58 @@
+from PIL import Image, ImageDraw
+import os
+import random
+import sys
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_page(size=(192, 128), mode="RGB", seed=0):
+    # Photo-like test page: gradients in each channel, coloured blocks and
+    # a little noise, the same for every run
+    rng = random.Random(seed)
+    w, h = size
+    img = Image.merge("RGB", (
+        Image.linear_gradient("L").resize(size),
+        Image.linear_gradient("L").rotate(90).resize(size),
+        Image.radial_gradient("L").resize(size),
+    ))
+    draw = ImageDraw.Draw(img)
+    for _ in range(30):
+        x, y = rng.randrange(w), rng.randrange(h)
+        draw.rectangle((x, y, x + rng.randrange(4, w // 5), y + rng.randrange(2, h // 6)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    img = Image.blend(img, Image.effect_noise(size, 20).convert("RGB"), 0.15)
+    return img.convert(mode)
+
+
+@pytest.fixture
+def page_image():
+    return make_page
+
+
+@pytest.fixture
+def thumb_dir(tmp_path, monkeypatch):
+    import image_to_pdf_thumbs as thumbs
+    monkeypatch.setenv("ITP_THUMB_DIR", str(tmp_path / "thumbs"))
+    monkeypatch.setattr(thumbs, "_default_store", None)
+    return tmp_path / "thumbs"
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    # Keep the user's disk store out of the tests
+    import image_to_pdf_store as store
+    monkeypatch.setenv("ITP_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setattr(store, "_default_store", None)
+    return tmp_path / "store"
+
+
+@pytest.fixture
+def no_store(monkeypatch):
+    # Every page is processed, worker processes included
+    import image_to_pdf_store as store
+    monkeypatch.setenv("ITP_STORE_MB", "0")
+    monkeypatch.setattr(store, "_default_store", None)
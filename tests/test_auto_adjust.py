@@ -0,0 +1,88 @@
+from PIL import ImageChops
+
+import pytest
+
+import image_to_pdf_core as core
+import image_to_pdf_document as documents
+import image_to_pdf_export as export
+
+
+def scan(page_image):
+    return core.to_bilevel(page_image(size=(400, 560)))
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+def test_bilevel_pages_stay_bilevel(page_image, adaptive):
+    img = scan(page_image)
+    out = core.auto_adjust(img, adaptive=adaptive)
+    assert out.mode == "1"
+    assert ImageChops.difference(out.convert("L"), img.convert("L")).getbbox() is None
+
+
+@pytest.mark.skipif(not documents.available(), reason="needs NumPy")
+def test_bilevel_pages_stay_bilevel_when_straightened(page_image):
+    assert core.auto_adjust(scan(page_image), document=True).mode == "1"
+
+
+def test_bilevel_pages_follow_an_explicit_scan_mode(page_image):
+    assert core.auto_adjust(scan(page_image), scan="gray").mode == "L"
+    assert core.auto_adjust(scan(page_image), scan="bilevel").mode == "1"
+
+
+def test_colour_pages_are_still_enhanced(page_image):
+    img = page_image()
+    out = core.auto_adjust(img)
+    assert out.mode == "RGB"
+    assert ImageChops.difference(out, img).getbbox() is not None
+
+
+def test_auto_adjusted_bilevel_files_export_as_ccitt(tmp_path, page_image, no_store):
+    path = tmp_path / "scan.png"
+    scan(page_image).save(path)
+    enc = export.encode_file(str(path), export.ExportOptions("auto"), auto_adjust=True)
+    assert enc.filter == ("CCITTFaxDecode" if export.features.check("libtiff") else "FlateDecode")
+    assert enc.bpc == 1
+
+
+def test_batch_takes_only_a_window_of_pages_at_a_time(page_image):
+    # Items are drawn from the iterable only as results are taken
+    taken = []
+
+    def items():
+        for i in range(50):
+            taken.append(i)
+            yield page_image(size=(40, 30), seed=i)
+
+    with core.make_pool(2, processes=False) as pool:
+        results = core.auto_adjust_all(items(), pool)
+        first = next(results)
+        assert first.size == (40, 30)
+        assert len(taken) <= 2 * 2 + 1
+        assert len(list(results)) == 49
+
+
+def test_batch_results_are_in_page_order(page_image):
+    images = [page_image(size=(40 + i, 30), seed=i) for i in range(12)]
+    with core.make_pool(4, processes=False) as pool:
+        sizes = [img.size for img in core.auto_adjust_all(iter(images), pool)]
+    assert sizes == [img.size for img in images]
+
+
+def test_pool_workers_store_the_adjusted_pages(page_image, store_dir):
+    import threading
+    from image_to_pdf_pages import ImageSource, pixels_key, stored_auto_adjust_task
+    from image_to_pdf_store import default_store
+
+    sources = [ImageSource(page_image(size=(40 + i, 30), seed=i)) for i in range(4)]
+    for i, source in enumerate(sources):
+        source.digest = f"{i:040d}"
+    keys = [pixels_key(source, [{"op": "auto"}]) for source in sources]
+    writers = set()
+    put_image = default_store().put_image
+    default_store().put_image = lambda key, img: writers.add(threading.get_ident()) or put_image(key, img)
+
+    with core.make_pool(2, processes=False) as pool:
+        results = list(core.pool_map(pool, stored_auto_adjust_task, zip(sources, keys)))
+    assert [img.size for img in results] == [s.img.size for s in sources]
+    assert [default_store().image_size(key) for key in keys] == [img.size for img in results]
+    assert threading.get_ident() not in writers
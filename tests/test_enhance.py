@@ -0,0 +1,59 @@
+from PIL import ImageChops
+import itertools
+
+import pytest
+
+import image_to_pdf_core as core
+
+# core.enhance is the fused form of core.enhance_chain. They round at
+# different points, so they may differ by a few levels; these are the
+# limits, per channel value, over the app's slider ranges. The largest
+# differences need saturation and sharpness both near the top, which
+# amplify the chain's rounding between its steps.
+MAX_DIFF = 16
+MEAN_DIFF = 2.0
+# At the factors auto_enhance uses, where nothing is pushed to the limits
+AUTO_MAX_DIFF = 5
+AUTO_MEAN_DIFF = 1.0
+
+BRIGHTNESS = (0.3, 0.7, 1.0, 1.3, 2.0)
+CONTRAST = (0.5, 1.0, 1.25, 2.0)
+SATURATION = (0.0, 1.0, 1.1, 2.0)
+SHARPNESS = (0.0, 1.0, 1.1, 3.0)
+
+
+def difference(a, b):
+    assert (a.mode, a.size) == (b.mode, b.size)
+    hist = ImageChops.difference(a, b).histogram()
+    levels = [i % 256 for i, n in enumerate(hist) if n]
+    mean = sum((i % 256) * n for i, n in enumerate(hist)) / sum(hist)
+    return max(levels), mean
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_fused_matches_chain_over_slider_range(page_image, mode):
+    img = page_image(mode=mode)
+    for factors in itertools.product(BRIGHTNESS, CONTRAST, SATURATION, SHARPNESS):
+        most, mean = difference(core.enhance(img, *factors), core.enhance_chain(img, *factors))
+        assert most <= MAX_DIFF and mean <= MEAN_DIFF, factors
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_fused_matches_chain_at_auto_factors(page_image, mode, seed):
+    img = page_image(mode=mode, seed=seed)
+    factors = (1.05, 1.25, 1.1, 1.1)
+    most, mean = difference(core.enhance(img, *factors), core.enhance_chain(img, *factors))
+    assert most <= AUTO_MAX_DIFF and mean <= AUTO_MEAN_DIFF
+
+
+def test_identity_returns_a_copy(page_image):
+    img = page_image()
+    out = core.enhance(img)
+    assert out is not img
+    assert difference(out, img) == (0, 0)
+
+
+def test_bilevel_is_enhanced_in_grey(page_image):
+    img = page_image(mode="1")
+    assert core.enhance(img, contrast=1.5).mode == "L"
@@ -0,0 +1,122 @@
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+from functools import partial
+import hashlib
+
+import pytest
+
+import image_to_pdf_core as core
+import image_to_pdf_export as export
+
+
+@pytest.fixture
+def files(tmp_path, page_image):
+    # JPEG (embedded as is), colour and grey PNG, a bilevel scan, and a
+    # file that appears twice so dedupe has something to do
+    paths = []
+    for i, (mode, ext) in enumerate([("RGB", "jpg"), ("RGB", "png"), ("L", "png"), ("1", "png")]):
+        path = tmp_path / f"p{i}.{ext}"
+        page_image(size=(300, 420), mode=mode, seed=i).save(path)
+        paths.append(str(path))
+    return paths + [paths[1], paths[0]]
+
+
+def digest(path):
+    with open(path, "rb") as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+@pytest.mark.parametrize("encoding", export.ENCODINGS)
+@pytest.mark.parametrize("auto_adjust", [False, True])
+def test_pooled_exports_match_serial_byte_for_byte(tmp_path, files, no_store, encoding, auto_adjust):
+    options = export.ExportOptions(encoding, quality=80, dpi=100)
+    task = partial(export.encode_file, auto_adjust=auto_adjust)
+    outputs = {}
+
+    def run(name, pool=None):
+        path = str(tmp_path / f"{name}.pdf")
+        count = export.write_pdf(files, path, options, pool=pool, task=task, key=export.file_key)
+        assert count == len(files)
+        outputs[name] = digest(path)
+
+    run("serial")
+    with core.make_pool(3, processes=False) as pool:
+        run("threads", pool)
+    with core.make_pool(2, processes=True) as pool:
+        run("processes", pool)
+
+    assert outputs["threads"] == outputs["serial"]
+    assert outputs["processes"] == outputs["serial"]
+
+
+def test_store_hits_give_the_same_file(tmp_path, files, store_dir):
+    # A repeat export reads every encoded page back from the disk store
+    options = export.ExportOptions("auto", quality=80, dpi=100)
+    task = partial(export.encode_file, auto_adjust=True)
+    first, second = str(tmp_path / "first.pdf"), str(tmp_path / "second.pdf")
+    export.write_pdf(files, first, options, task=task, key=export.file_key)
+    export.write_pdf(files, second, options, task=task, key=export.file_key)
+    assert digest(first) == digest(second)
+
+
+@pytest.mark.parametrize("angle", [0, 90, 180, 270])
+def test_reopened_export_keeps_turns_and_crops(tmp_path, page_image, no_store, angle):
+    # A JPEG is embedded as is and placed turned and clipped; reading the
+    # PDF back gives the edited page, not the original image
+    from image_to_pdf_history import HistoryStore
+    from image_to_pdf_pages import Page, PageCache, file_sources
+    path = tmp_path / "photo.jpg"
+    page_image(size=(300, 200)).save(path)
+    page = Page.from_file(str(path), HistoryStore(), PageCache())
+    page.edit({"op": "rotate", "angle": angle})
+    w, h = page.size
+    page.edit({"op": "crop", "box": [20, 10, w - 40, h - 30]})
+
+    out = str(tmp_path / "out.pdf")
+    export.write_pdf([page], out, export.ExportOptions("jpeg"), task=export.encode_page_task)
+    assert export.page_item(page, export.ExportOptions("jpeg")).geometry
+
+    # pypdf's JPEG decode differs from Pillow's by a level or so; a box off
+    # by a pixel or a wrong turn is far worse on this noisy page
+    source, = file_sources(out)
+    assert source.info()[0] == page.size
+    diff = ImageChops.difference(source.load(), page.image)
+    assert max(ImageStat.Stat(diff).mean) < 2
+
+
+def test_skewed_pdf_pages_are_rejected(tmp_path, page_image):
+    from image_to_pdf_pages import UnsupportedPdf, file_sources
+    out = str(tmp_path / "skewed.pdf")
+    enc = export.encode_page(page_image(size=(60, 40)), export.ExportOptions("jpeg"))
+    with export.PdfWriter(out) as writer:
+        num = writer.add_image(enc)
+        writer.add_page((200, 200), b"q 60 20 0 40 10 10 cm /Im0 Do Q", {"Im0": num})
+
+    source, = file_sources(out)
+    with pytest.raises(UnsupportedPdf):
+        source.info()
+
+
+def text_page(size=(1240, 1754)):
+    # Bilevel A4 page at 150 dpi: lines of word-like boxes on white
+    img = Image.new("1", size, 1)
+    draw = ImageDraw.Draw(img)
+    for y in range(120, size[1] - 120, 40):
+        x = 100
+        while x < size[0] - 140:
+            w = 10 + (x * 7 + y) % 30
+            draw.rectangle((x, y, x + w, y + 18), outline=0, width=3)
+            x += w + 8 + (x % 3) * 6
+    return img
+
+
+def test_downsampled_bilevel_pages_are_thresholded():
+    options = export.ExportOptions("auto", dpi=100)
+    img = text_page()
+    out = export.downsample(img, options)
+    grey = img.convert("L").resize(out.size, Image.Resampling.BOX)
+    assert out.mode == "1" and out.size < img.size
+    assert out.tobytes() == grey.point(lambda v: 255 if v >= 128 else 0).convert("1").tobytes()
+
+    # Dithered edge greys cost several times the bytes of a plain threshold
+    dithered = export.encode_image(grey.convert("1"), "auto", options.quality)
+    assert len(export.encode_page(img, options).data) * 2 < len(dithered.data)
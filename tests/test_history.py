@@ -0,0 +1,38 @@
+from PIL import Image
+import threading
+
+from image_to_pdf_history import HistoryStore
+
+
+def test_keyframes_spill_while_other_threads_read():
+    # A budget of about three keyframes: adding more spills the oldest
+    # while reader threads keep touching and loading all of them
+    store = HistoryStore(budget_bytes=3 * 64 * 64 * 3)
+    frames = []
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            for i, kf in enumerate(list(frames)):
+                try:
+                    img = kf.get()
+                    assert img.getpixel((0, 0)) == (i % 256, 0, 0)
+                except Exception as e:
+                    errors.append(e)
+                    return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in readers:
+        t.start()
+    try:
+        for i in range(200):
+            frames.append(store.keyframe(Image.new("RGB", (64, 64), (i % 256, 0, 0))))
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+        store.close()
+
+    assert not errors, errors[0]
+    assert len(store.in_memory) <= 3
@@ -0,0 +1,161 @@
+from PIL import Image
+import threading
+
+from image_to_pdf_history import HistoryStore
+from image_to_pdf_pages import ImageSource, Page, PageCache
+
+
+class SlowSource(ImageSource):
+    # Decoding waits until the test lets it finish
+    def __init__(self, img):
+        super().__init__(img)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def load(self, draft=None):
+        self.started.set()
+        assert self.release.wait(10)
+        return self.img.copy()
+
+
+def slow_page(size=(40, 30)):
+    source = SlowSource(Image.new("RGB", size, (200, 10, 10)))
+    return Page(source, HistoryStore(), PageCache()), source
+
+
+def render_in_background(fn):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("img", fn()))
+    thread.start()
+    return thread, result
+
+
+def test_edit_during_render_is_not_cached_as_the_new_version():
+    page, source = slow_page()
+    thread, result = render_in_background(lambda: page.image)
+    assert source.started.wait(10)
+
+    page.edit({"op": "rotate", "angle": 90})  # while the render runs
+    source.release.set()
+    thread.join()
+
+    assert result["img"].size == (40, 30)  # what was asked for
+    assert page.size == (30, 40)
+    assert page.image.size == (30, 40)
+
+
+def test_undo_during_render_keeps_the_undone_size():
+    page, source = slow_page()
+    source.release.set()
+    page.edit({"op": "crop", "box": [0, 0, 20, 10]})
+    assert page.image.size == (20, 10)
+
+    page.cache.clear()
+    source.release.clear()
+    source.started.clear()
+    thread, _ = render_in_background(lambda: page.image)
+    assert source.started.wait(10)
+    page.undo()
+    source.release.set()
+    thread.join()
+
+    assert page.size == (40, 30)
+    assert page.image.size == (40, 30)
+
+
+def test_preview_during_edit_is_not_cached_as_the_new_version():
+    page, source = slow_page()
+    thread, _ = render_in_background(lambda: page.preview((100, 100)))
+    assert source.started.wait(10)
+    page.edit({"op": "rotate", "angle": 90})
+    source.release.set()
+    thread.join()
+
+    assert page.image.size == (30, 40)
+
+
+def test_edit_with_a_stored_result_is_read_back_lazily(store_dir):
+    import image_to_pdf_core as core
+    from image_to_pdf_pages import pixels_key
+    from image_to_pdf_store import default_store
+
+    page, source = slow_page()
+    source.release.set()
+    page.source.digest = "f" * 40  # a stable source, as files have
+    op = {"op": "scan", "mode": "gray"}
+    result = core.apply_op(page.image, op)
+    default_store().put_image(pixels_key(page.source, [op]), result)
+
+    loads = []
+    source.load = lambda draft=None: loads.append(1) or source.img.copy()
+    page.cache.clear()
+    page.edit(op, size=result.size)
+    assert page.size == (40, 30)
+    assert page.image.mode == "L"
+    assert not loads  # came from the store, the source was not decoded
+
+
+def test_render_for_the_ui_is_stored_in_the_background(store_dir, monkeypatch):
+    from image_to_pdf_pages import pixels_key
+    from image_to_pdf_store import PageStore
+
+    release = threading.Event()
+    writers = []
+    put_image = PageStore.put_image
+
+    def slow_put(self, key, img):
+        writers.append(threading.current_thread())
+        assert release.wait(10)
+        put_image(self, key, img)
+
+    monkeypatch.setattr(PageStore, "put_image", slow_put)
+    page, source = slow_page()
+    source.release.set()
+    page.source.digest = "e" * 40
+    op = {"op": "scan", "mode": "gray"}
+    page.edit(op, size=page.size)
+
+    assert page.image.mode == "L"  # returns while the write waits
+    release.set()
+    page.store.flush()
+    assert writers and threading.current_thread() not in writers
+    assert page.store.image_size(pixels_key(page.source, [op])) == (40, 30)
+
+
+def test_snapshot_loads_like_a_source():
+    page, source = slow_page()
+    source.release.set()
+    snap = page.snapshot()
+    assert snap.load().size == (40, 30)
+    page.edit({"op": "rotate", "angle": 90})
+    assert page.snapshot().load().size == (30, 40)
+    assert snap.load().size == (40, 30)
+
+
+def write_scan_pdf(path, page_image, count):
+    # Image-only PDF, one image per page as a scanner writes it
+    images = [page_image(size=(60 + i, 40), seed=i) for i in range(count)]
+    images[0].save(path, save_all=True, append_images=images[1:])
+    return images
+
+
+def count_pdf_parses(monkeypatch):
+    import image_to_pdf_pages as pages
+    parses = []
+    reader = pages.pdf_reader
+    monkeypatch.setattr(pages, "_pdf_files", pages.OrderedDict())
+    monkeypatch.setattr(pages, "pdf_reader", lambda fh: parses.append(fh) or reader(fh))
+    return parses
+
+
+def test_pdf_pages_share_one_parsed_reader(tmp_path, page_image, store_dir, monkeypatch):
+    from image_to_pdf_pages import file_sources
+    parses = count_pdf_parses(monkeypatch)
+    path = str(tmp_path / "scan.pdf")
+    images = write_scan_pdf(path, page_image, 5)
+
+    store, cache = HistoryStore(), PageCache()
+    pages = [Page(source, store, cache) for source in file_sources(path)]
+    assert [p.source_size for p in pages] == [img.size for img in images]
+    assert pages[3].image.size == images[3].size
+    assert len(parses) == 1
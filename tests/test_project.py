@@ -0,0 +1,88 @@
+import zipfile
+
+import image_to_pdf_project as project
+from image_to_pdf_history import HistoryStore
+from image_to_pdf_pages import Page, PageCache
+
+
+def make_pages(tmp_path, page_image, count=3):
+    store, cache = HistoryStore(), PageCache()
+    pages = []
+    for i in range(count):
+        path = tmp_path / f"p{i}.png"
+        page_image(size=(60, 40), seed=i).save(path)
+        pages.append(Page.from_file(str(path), store, cache))
+    return pages
+
+
+def members(path, prefix):
+    with zipfile.ZipFile(path) as z:
+        return [n for n in z.namelist() if n.startswith(prefix)]
+
+
+def test_repeated_saves_are_compacted(tmp_path, page_image, thumb_dir, store_dir, monkeypatch):
+    monkeypatch.setattr(project, "COMPACT_ENTRIES", 10)
+    path = str(tmp_path / "book.itp")
+    pages = make_pages(tmp_path, page_image)
+
+    # Every save after an edit appends a manifest and new thumbnails
+    for i in range(12):
+        pages[0].edit({"op": "rotate", "angle": 90})
+        project.save(path, project.snapshot(pages, 0))
+        assert len(members(path, project.MANIFEST_DIR)) <= 1 + 10
+    del pages[1]
+    project.save(path, project.snapshot(pages, 1))
+
+    assert not (tmp_path / "book.itp.part").exists()
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+
+    index, entries = project.load(path)
+    assert index == 1
+    assert [e.ops for e in entries] == [p.ops for p in pages]
+    assert entries[0].ops == [{"op": "rotate", "angle": 90}] * 12
+    assert len(members(path, "sources/")) <= 3
+
+
+def test_compaction_drops_dead_entries_and_keeps_pages_readable(tmp_path, page_image, thumb_dir,
+                                                                store_dir, monkeypatch):
+    path = str(tmp_path / "book.itp")
+    pages = make_pages(tmp_path, page_image)
+    project.save(path, project.snapshot(pages, 0))
+
+    # Reopened pages read from the project file, which is then rewritten
+    _, entries = project.load(path)
+    store, cache = HistoryStore(), PageCache()
+    reopened = [Page(e.source, store, cache) for e in entries][:1]
+    monkeypatch.setattr(project, "COMPACT_ENTRIES", 0)
+    project.save(path, project.snapshot(reopened, 0))
+
+    assert len(members(path, project.MANIFEST_DIR)) == 1
+    assert len(members(path, "sources/")) == 1
+    assert len(members(path, project.THUMB_DIR)) == 1
+    assert reopened[0].image.size == (60, 40)
+
+
+def test_snapshot_reads_no_headers_and_pdf_members_are_parsed_once(tmp_path, page_image, thumb_dir,
+                                                                   store_dir, monkeypatch):
+    from image_to_pdf_pages import FileSource, file_sources
+    from test_pages import count_pdf_parses, write_scan_pdf
+    pdf = str(tmp_path / "scan.pdf")
+    images = write_scan_pdf(pdf, page_image, 4)
+    store, cache = HistoryStore(), PageCache()
+    pages = [Page(source, store, cache) for source in file_sources(pdf)]
+
+    # The UI thread takes the snapshot; the save worker reads the headers
+    reads = []
+    info = FileSource.info
+    monkeypatch.setattr(FileSource, "info", lambda self: reads.append(self) or info(self))
+    snap = project.snapshot(pages, 0)
+    assert reads == []
+    path = str(tmp_path / "scan.itp")
+    project.save(path, snap)
+    assert reads
+
+    parses = count_pdf_parses(monkeypatch)
+    _, entries = project.load(path)
+    assert [e.source.load().size for e in entries] == [img.size for img in images]
+    assert len(parses) == 1
@@ -0,0 +1,27 @@
+import os
+import time
+
+from image_to_pdf_thumbs import ThumbStore
+
+
+def stored_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names)
+
+
+def test_thumbnail_store_keeps_to_its_budget(tmp_path):
+    # A generous budget while writing, so no eviction runs in the background
+    store = ThumbStore(str(tmp_path / "thumbs"), budget_bytes=1 << 30)
+    keys = [f"{i:040x}" for i in range(40)]
+    for i, key in enumerate(keys):
+        store.put(key, bytes(1000))
+        # Oldest first, then the first thumbnail is used again
+        os.utime(store._path(key), (time.time() - 100 + i,) * 2)
+    assert store.get(keys[0])
+
+    store.budget = 10_000
+    store.evict()
+    assert stored_bytes(tmp_path / "thumbs") <= 10_000
+    assert store.get(keys[0]) and store.get(keys[-1])
+    assert store.get(keys[1]) is None
+    assert os.path.exists(store._path(keys[-1])) and store._path(keys[-1]).endswith(".jpg")
@@ -0,0 +1,49 @@
+import os
+
+import image_to_pdf_core as core
+import image_to_pdf_export as export
+import image_to_pdf_watch as watch
+
+
+def test_output_inside_the_watched_folder_is_not_converted_again(tmp_path, page_image, no_store):
+    watched = tmp_path / "scans"
+    (watched / "letter").mkdir(parents=True)
+    for i in range(2):
+        page_image(size=(60, 40), seed=i).save(watched / "letter" / f"{i}.png")
+    output = watched / "pdfs"
+    checkpoint = watch.Checkpoint(str(output / ".itp-watch.json"))
+    logged = []
+
+    with core.make_pool(2, processes=False) as pool:
+        for _ in range(2):
+            # The second pass sees the PDF and checkpoint the first wrote
+            watcher = watch.Watcher([str(watched)], str(output), export.ExportOptions(), pool,
+                                    checkpoint, settle=0, auto_adjust=False, log=logged.append)
+            watcher.run(interval=0, once=True)
+
+    assert sorted(os.listdir(output)) == [".itp-watch.json", "letter.pdf"]
+    assert list(checkpoint.documents) == [os.path.abspath(watched / "letter")]
+    assert len(logged) == 1
+
+
+def test_manifest_globs_skip_the_output_directory(tmp_path, page_image):
+    watched = tmp_path / "in"
+    watched.mkdir()
+    page_image(size=(60, 40)).save(watched / "a.png")
+    (watched / "out").mkdir()
+    (watched / "out" / "old.pdf").write_bytes(b"%PDF-1.4")
+    (watched / "job.json").write_text('{"output": "all.pdf", "inputs": ["*.png", "out/*"]}')
+
+    skip = {os.path.realpath(watched / "out")}
+    docs = list(watch.discover(str(watched), str(watched / "out"), skip))
+    assert [os.path.basename(f) for doc, _ in docs for f in doc.files] == ["a.png"]
+
+
+def test_document_option_needs_numpy_and_reaches_auto_adjust(monkeypatch, tmp_path):
+    seen = {}
+    monkeypatch.setattr(watch.documents, "available", lambda: True)
+    monkeypatch.setattr(watch.Watcher, "run",
+                        lambda self, *a, **k: seen.update(self.auto_options))
+    assert watch.main([str(tmp_path), "--output", str(tmp_path / "out"), "--once",
+                       "--threads", "--document"]) == 0
+    assert seen == {"document": True}